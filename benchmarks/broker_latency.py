@@ -0,0 +1,130 @@
+"""Measures the read latency of the broker when the servers stall now and then, like a server that pauses for the
+garbage collector or shares its machine with a noisy neighbour. The reads are sent to all the servers, to the
+fastest ones and to the fastest ones with hedging, and the percentiles of their latencies are compared.
+
+Usage: python -m benchmarks.broker_latency [--servers 3] [-k 2] [--reads 4000] [--concurrency 4]
+       [--stall-probability 0.002] [--stall 0.02]
+"""
+
+import argparse
+import multiprocessing as mp
+import random
+import statistics
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple
+
+from benchmarks.client_throughput import wait_for
+from broker.broker import KeyValueBroker
+from server.server import KeyValueServer
+from server.sharded_server import find_free_port
+from tools.general_tools import data_string_to_dict
+
+
+class StallingKeyValueServer(KeyValueServer):
+    """A server that sleeps before some of the commands"""
+
+    def __init__(
+        self, server_address: Tuple[str, int], probability: float, stall: float
+    ):
+        super().__init__(server_address)
+        self.probability = probability
+        self.stall = stall
+
+    def process_command(self, client_address: Any, payload: str) -> str:
+        if random.random() < self.probability:
+            time.sleep(self.stall)
+        return super().process_command(client_address, payload)
+
+
+def run_server(port: int, probability: float, stall: float) -> None:
+    StallingKeyValueServer(("127.0.0.1", port), probability, stall).serve()
+
+
+def percentile(latencies: List[float], percentile_: float) -> float:
+    return latencies[min(len(latencies) - 1, int(len(latencies) * percentile_ / 100))]
+
+
+def measure(broker: KeyValueBroker, keys: List[str], concurrency: int) -> List[float]:
+    """Reads the keys from concurrent threads
+    :return: The sorted latencies of the reads in seconds
+    """
+
+    def read(key: str) -> float:
+        start = time.perf_counter()
+        broker.execute_command("GET", [key])
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sorted(executor.map(read, keys))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=3)
+    parser.add_argument("-k", type=int, default=2)
+    parser.add_argument("--reads", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--stall-probability", type=float, default=0.002)
+    parser.add_argument("--stall", type=float, default=0.02)
+    parser.add_argument("--dataset", default="test_data_files/dataset.txt")
+    args = parser.parse_args()
+
+    servers = [("127.0.0.1", find_free_port("127.0.0.1")) for _ in range(args.servers)]
+    processes = [
+        mp.Process(
+            target=run_server,
+            args=(port, args.stall_probability, args.stall),
+            daemon=True,
+        )
+        for _, port in servers
+    ]
+    for process, server in zip(processes, servers):
+        process.start()
+        wait_for(server, broker=False)
+
+    with open(args.dataset) as f:
+        records = [data_string_to_dict(line) for line in f]
+    broker = KeyValueBroker(servers, args.k)
+    broker.index_procedure(records)
+    broker.close()
+    keys = [next(iter(records[it % len(records)])) for it in range(args.reads)]
+
+    print(
+        f"cores: {mp.cpu_count()}, servers: {args.servers}, k: {args.k}, reads: {args.reads}, "
+        f"stalls: {args.stall * 1000:.0f} ms on {args.stall_probability:.1%} of the commands"
+    )
+    print(
+        f"{'reads':>22} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'p99.9':>8} (ms) {'p99 cut':>8}"
+    )
+    baseline: Optional[float] = None
+    for name, latency_aware, hedge_percentile in [
+        ("all servers", False, None),
+        ("fastest servers", True, None),
+        ("hedged at p90", True, 90.0),
+        ("hedged at p95", True, 95.0),
+    ]:
+        broker = KeyValueBroker(servers, args.k, latency_aware, hedge_percentile)
+        # Warms up the connections & the response time statistics
+        measure(broker, keys[: args.reads // 10], args.concurrency)
+        latencies = measure(broker, keys, args.concurrency)
+        broker.close()
+
+        p99 = percentile(latencies, 99)
+        if baseline is None:
+            baseline = p99
+        print(
+            f"{name:>22} {statistics.mean(latencies) * 1000:>8.2f} "
+            + " ".join(
+                f"{percentile(latencies, p) * 1000:>8.2f}" for p in [50, 95, 99, 99.9]
+            )
+            + f"      {1 - p99 / baseline:>8.1%}"
+        )
+
+    for process in processes:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Measures the throughput of the client library against a server and against a broker, with one request per round
+trip, with concurrent requests over the connection pool and with pipelined batches. The server & the broker run in
+separate processes so they don't compete with the client for the GIL.
+
+Usage: python -m benchmarks.client_throughput [--requests 4000] [--concurrency 8] [--batch 100]
+"""
+
+import argparse
+import asyncio
+import multiprocessing as mp
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Callable
+
+from broker.broker import KeyValueBroker
+from broker.broker_server import KeyValueBrokerServer
+from client.async_client import AsyncKeyValueClient
+from client.client import KeyValueClient
+from server.server import KeyValueServer
+from server.sharded_server import find_free_port
+from tools.general_tools import data_string_to_dict
+
+
+def run_server(port: int) -> None:
+    KeyValueServer(("127.0.0.1", port)).serve()
+
+
+def run_broker(server_ports: List[int], port: int) -> None:
+    broker = KeyValueBroker([("127.0.0.1", port_) for port_ in server_ports], 1)
+    KeyValueBrokerServer(("127.0.0.1", port), broker).serve()
+
+
+def wait_for(address: Tuple[str, int], broker: bool) -> None:
+    """Waits until a started process serves requests"""
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            with KeyValueClient(address, broker=broker, retries=0) as client:
+                client.scan()
+                return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def sequential(client: KeyValueClient, commands: List[Tuple[str, object]], _) -> None:
+    for command, data in commands:
+        client.execute(command, data)
+
+
+def threaded(client: KeyValueClient, commands: List[Tuple[str, object]], args) -> None:
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(lambda command: client.execute(*command), commands))
+
+
+def pipelined(client: KeyValueClient, commands: List[Tuple[str, object]], args) -> None:
+    for index in range(0, len(commands), args.batch):
+        client.execute_many(commands[index : index + args.batch])
+
+
+def asynchronous(address: Tuple[str, int], broker: bool, pipeline: bool) -> Callable:
+    def run(_, commands: List[Tuple[str, object]], args) -> None:
+        async def main() -> None:
+            async with AsyncKeyValueClient(
+                address, broker=broker, pool_size=args.concurrency
+            ) as client:
+                if pipeline:
+                    batches = [
+                        commands[index : index + args.batch]
+                        for index in range(0, len(commands), args.batch)
+                    ]
+                    await asyncio.gather(
+                        *[client.execute_many(batch) for batch in batches]
+                    )
+                    return
+                semaphore = asyncio.Semaphore(args.concurrency)
+
+                async def execute(command: Tuple[str, object]) -> None:
+                    async with semaphore:
+                        await client.execute(*command)
+
+                await asyncio.gather(*[execute(command) for command in commands])
+
+        asyncio.run(main())
+
+    return run
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--dataset", default="test_data_files/dataset.txt")
+    args = parser.parse_args()
+
+    with open(args.dataset) as f:
+        records = [data_string_to_dict(line) for line in f]
+    commands = list()
+    for it in range(args.requests):
+        record = records[it % len(records)]
+        key = next(iter(record))
+        commands.append(("GET", [key]) if it % 2 else ("PUT", record))
+
+    server_port = find_free_port("127.0.0.1")
+    broker_port = find_free_port("127.0.0.1")
+    processes = [
+        mp.Process(target=run_server, args=(server_port,), daemon=True),
+        mp.Process(target=run_broker, args=([server_port], broker_port), daemon=True),
+    ]
+    processes[0].start()
+    wait_for(("127.0.0.1", server_port), broker=False)
+    processes[1].start()
+    wait_for(("127.0.0.1", broker_port), broker=True)
+
+    print(f"cores: {mp.cpu_count()}, requests: {args.requests}")
+    for name, port, broker in [
+        ("server", server_port, False),
+        ("broker", broker_port, True),
+    ]:
+        address = ("127.0.0.1", port)
+        for mode, run in [
+            ("sequential", sequential),
+            (f"{args.concurrency} threads", threaded),
+            (f"pipelined x{args.batch}", pipelined),
+            (f"asyncio x{args.concurrency}", asynchronous(address, broker, False)),
+            (f"asyncio pipelined x{args.batch}", asynchronous(address, broker, True)),
+        ]:
+            with KeyValueClient(
+                address, broker=broker, pool_size=args.concurrency
+            ) as client:
+                start = time.perf_counter()
+                run(client, commands, args)
+                elapsed = time.perf_counter() - start
+            print(f"{name:>6} {mode:>24} {args.requests / elapsed:>10.1f} requests/s")
+
+    for process in processes:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
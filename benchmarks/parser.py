@@ -0,0 +1,74 @@
+"""Microbenchmarks of the single pass command parser against the previous ast.literal_eval based parsing, on
+generated records of various nesting depths.
+
+Usage: python -m benchmarks.parser [--records 500]
+"""
+
+import argparse
+import ast
+import timeit
+
+from data_generator.data_generator import generated_key_value_pairs
+from tools.command_parser import parse_data
+from tools.general_tools import read_keys_and_types_from_file
+
+
+def literal_eval_data_string(string_data: str) -> dict:
+    """The previous parsing of a data file line / PUT command at the broker"""
+    return ast.literal_eval("{" + string_data.replace(";", ",") + "}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with open("test_data_files/keyFile.txt") as f:
+        key_names = read_keys_and_types_from_file(f)
+
+    print(
+        f"{'depth':>5} {'avg bytes':>9} | {'broker literal_eval':>19} {'broker parser':>13} {'speedup':>7} | "
+        f"{'server literal_eval':>19} {'server parser':>13} {'speedup':>7}"
+    )
+    for depth in range(6):
+        records = generated_key_value_pairs(
+            number_of_lines=args.records,
+            level_of_nesting=depth,
+            max_number_of_keys=5,
+            max_word_length=5,
+            key_names=key_names,
+        )
+        # The broker receives the data file format, the servers the Python repr of the parsed dictionaries
+        broker_lines = [str(record)[1:-1].replace(",", ";") for record in records]
+        server_lines = [str(record) for record in records]
+        avg_bytes = sum(len(line) for line in broker_lines) / len(broker_lines)
+
+        timings = list()
+        for lines, old, new in [
+            (
+                broker_lines,
+                literal_eval_data_string,
+                lambda line: parse_data(line, pairs=True),
+            ),
+            (server_lines, ast.literal_eval, parse_data),
+        ]:
+            for function in [old, new]:
+                seconds = min(
+                    timeit.repeat(
+                        lambda: [function(line) for line in lines],
+                        number=1,
+                        repeat=args.repeat,
+                    )
+                )
+                timings.append(seconds * 1e6 / len(lines))
+
+        print(
+            f"{depth:>5} {avg_bytes:>9.0f} | {timings[0]:>16.1f} us {timings[1]:>10.1f} us "
+            f"{timings[0] / timings[1]:>6.2f}x | {timings[2]:>16.1f} us {timings[3]:>10.1f} us "
+            f"{timings[2] / timings[3]:>6.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Measures the throughput of a single process server against a sharded one. The clients run in separate processes
+so they don't compete with the server for the GIL.
+
+Usage: python -m benchmarks.server_throughput [--workers 1 2 4] [--clients 8] [--requests 2000]
+
+Throughput scales with the number of workers only while there are free cores for them and for the clients.
+"""
+
+import argparse
+import multiprocessing as mp
+import socket
+import threading as td
+import time
+
+from typing import List
+
+from server.server import KeyValueServer
+from server.sharded_server import ShardedKeyValueServer, find_free_port
+from tools.general_tools import data_string_to_dict
+
+
+def run_client(port: int, records: List[dict], requests: int) -> None:
+    """Sends PUT & GET commands of the given records over a persistent connection
+    :param port: The port of the server
+    :param records: The records to use
+    :param requests: The number of requests to send
+    :return: None
+    """
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        rfile = sock.makefile("rb")
+        for it in range(requests):
+            record = records[it % len(records)]
+            if it % 2:
+                payload = f"GET {list(record.keys())}"
+            else:
+                payload = f"PUT {record}"
+            sock.sendall(bytes(payload + "\n", "utf-8"))
+            rfile.readline()
+
+
+def measure(workers: int, clients: int, requests: int, records: List[dict]) -> float:
+    """Starts a server with the given number of workers and returns the requests per second it served
+    :param workers: The number of worker processes, 1 for a single process server
+    :param clients: The number of client processes
+    :param requests: The number of requests per client
+    :param records: The records to use
+    :return: The requests per second
+    """
+    port = find_free_port("127.0.0.1")
+    if workers > 1:
+        server = ShardedKeyValueServer(("127.0.0.1", port), workers=workers)
+    else:
+        server = KeyValueServer(("127.0.0.1", port))
+    thread = td.Thread(target=server.serve, daemon=True)
+    thread.start()
+
+    processes = [
+        mp.Process(target=run_client, args=(port, records, requests))
+        for _ in range(clients)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    server.shutdown()
+    thread.join()
+    return clients * requests / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--dataset", default="test_data_files/dataset.txt")
+    args = parser.parse_args()
+
+    with open(args.dataset) as f:
+        records = [data_string_to_dict(line) for line in f]
+
+    print(f"cores: {mp.cpu_count()}, clients: {args.clients}")
+    for workers in args.workers:
+        rate = measure(workers, args.clients, args.requests, records)
+        print(f"workers: {workers:>3}  {rate:>10.1f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Compares the per record memory footprint of the Trie index with and without the compact representation of small
+nested values and the interned field names.
+
+Usage: python -m benchmarks.trie_memory [dataset.txt ...]
+
+When no dataset is given the bundled test_data_files/dataset.txt is measured along with a freshly generated one.
+"""
+
+import sys
+
+from typing import List
+
+from data_generator.data_generator import generated_key_value_pairs
+from server.field_names import FieldNameDictionary
+from server.trie import Trie, TrieNode, CompactMap, COMPACT_MAP_THRESHOLD
+from tools.general_tools import data_string_to_dict, read_keys_and_types_from_file
+
+
+def deep_size(obj) -> int:
+    """Sums the size of an object and of everything it references. Shared objects are counted once.
+    :param obj: The object to measure
+    :return: The size in bytes
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (Trie, TrieNode, FieldNameDictionary)):
+            stack.append(obj.__dict__)
+        elif isinstance(obj, CompactMap):
+            stack.extend([obj.keys, obj.values])
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (tuple, list)):
+            stack.extend(obj)
+    return size
+
+
+def measure(records: List[dict], compact_threshold: int, intern: bool) -> int:
+    """Inserts the records into an empty Trie and returns its memory footprint in bytes
+    :param records: The records to insert
+    :param compact_threshold: The CompactMap threshold of the Trie
+    :param intern: Whether to intern the nested field names
+    :return: The size in bytes
+    """
+    trie = Trie(
+        compact_threshold=compact_threshold,
+        field_names=FieldNameDictionary() if intern else None,
+    )
+    for record in records:
+        trie.insert_dict(record)
+    return deep_size(trie)
+
+
+def report(name: str, records: List[dict]) -> None:
+    """Prints the memory comparison of a dataset
+    :param name: The name of the dataset
+    :param records: The records of the dataset
+    :return: None
+    """
+    full_tries = measure(records, compact_threshold=0, intern=False)
+    interned_tries = measure(records, compact_threshold=0, intern=True)
+    hybrid = measure(records, compact_threshold=COMPACT_MAP_THRESHOLD, intern=False)
+    interned_hybrid = measure(
+        records, compact_threshold=COMPACT_MAP_THRESHOLD, intern=True
+    )
+    print(f"{name} ({len(records)} records)")
+    for label, allocated in [
+        ("tries", full_tries),
+        ("tries + interned names", interned_tries),
+        ("hybrid", hybrid),
+        ("hybrid + interned names", interned_hybrid),
+    ]:
+        print(
+            f"    {label:<24} {allocated / len(records):>9.1f} B/record  "
+            f"saved: {100 * (1 - allocated / full_tries):5.1f}%"
+        )
+
+
+def main(files: List[str]) -> None:
+    datasets = list()
+    for path in files:
+        with open(path) as f:
+            datasets.append((path, [data_string_to_dict(line) for line in f]))
+
+    if not files:
+        with open("test_data_files/dataset.txt") as f:
+            datasets.append(
+                (
+                    "test_data_files/dataset.txt",
+                    [data_string_to_dict(line) for line in f],
+                )
+            )
+        with open("test_data_files/keyFile.txt") as f:
+            key_names = read_keys_and_types_from_file(f)
+        for nesting, max_keys in [(0, 5), (3, 5), (5, 5)]:
+            records = generated_key_value_pairs(
+                number_of_lines=2000,
+                level_of_nesting=nesting,
+                max_number_of_keys=max_keys,
+                max_word_length=5,
+                key_names=key_names,
+            )
+            # Round trip through the data file format, the servers receive parsed records and not the generated ones
+            records = [
+                data_string_to_dict(str(record)[1:-1].replace(",", ";"))
+                for record in records
+            ]
+            datasets.append((f"generated -n 2000 -d {nesting} -m {max_keys}", records))
+
+    print(f"CompactMap threshold: {COMPACT_MAP_THRESHOLD} keys")
+    for name, records in datasets:
+        report(name, records)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
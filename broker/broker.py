@@ -1,38 +1,74 @@
 import logging
 import socket
 import time
-import multiprocessing as mp
 import threading as td
 
-from typing import List, Union, Optional
-from random import sample
+from concurrent.futures import Future
+from typing import Callable, List, Union, Optional
+from random import sample, random
+
+from broker.connection import ServerConnection, gather
+from broker.replicas import LatencyWindow, ReplicaRead, Scheduler
 from tools.general_tools import (
     validate_ip_port,
     merge_server_results,
+    merge_scan_results,
     CustomBrokerConnectionException,
+    CustomValidationException,
 )
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of PUT commands of the indexing procedure that are in flight at the same time
+INDEX_PIPELINE_DEPTH = 1000
+
+
+def found(result: str) -> bool:
+    """
+    :param result: The response of a server to a GET or QUERY command
+    :return: True if the server found the key, so the other replicas don't have to answer
+    """
+    return result not in ["NOT FOUND", "ERROR", "CONNECTION REFUSED"]
+
 
 class KeyValueBroker:
-    def __init__(self, servers: List[tuple], replication_factor: int):
+    def __init__(
+        self,
+        servers: List[tuple],
+        replication_factor: int,
+        latency_aware: bool = True,
+        hedge_percentile: Optional[float] = None,
+    ):
+        """
+        :param servers: The IP addresses & ports of the servers
+        :param replication_factor: The number of servers that store every key
+        :param latency_aware: If True the writes go to the least loaded servers & the reads to the fastest ones that
+        are enough to find any key, otherwise the writes go to random servers & the reads to all of them
+        :param hedge_percentile: If given, a read that hasn't been answered by this percentile of the recent
+        response times is sent to one more server too, e.g. 95
+        """
         for ip, port in servers:
             validate_ip_port(ip_address=ip, port=port)
+        if hedge_percentile is not None and not 0 < hedge_percentile < 100:
+            raise CustomValidationException(
+                "The hedging percentile should be between 0 and 100"
+            )
 
         self.servers = servers
         self.replication_factor = replication_factor
+        self.latency_aware = latency_aware
+        self.hedge_percentile = hedge_percentile
         self.online_servers = []
 
         # Check that the given servers are reachable
         self.__servers_check(raise_connection_error=True)
 
-        # Processes Pool that will be used to assign parallel requests to servers
-        self.pool = mp.Pool(processes=4)
+        # Persistent connections to the servers, shared by all the commands
+        self.latencies = LatencyWindow()
+        self.connections = {server: ServerConnection(server) for server in servers}
+        self.scheduler = Scheduler() if hedge_percentile is not None else None
 
         # Initiating thread for checking the health of the servers
-        self.pause_daemon = False
-        self.pause_cond = td.Condition(td.Lock())
         self.daemon = td.Thread(
             name="daemon-server-watchdog", target=self.__server_watchdog, daemon=True
         )
@@ -47,98 +83,85 @@ class KeyValueBroker:
         :return: None
         """
         while True:
-            # Pause Condition Variable
-            with self.pause_cond:
-                while self.pause_daemon:
-                    self.pause_cond.wait()
-            # Server checking
             self.__servers_check(raise_connection_error=False)
             time.sleep(2)
 
-    def __pause_watchdog(self) -> None:
-        """Pauses daemon service
-        :return: None
-        """
-        self.pause_daemon = True
-        self.pause_cond.acquire()
-
-    def __resume_watchdog(self) -> None:
-        """Resumes daemon service
-        :return:
-        """
-        self.pause_daemon = False
-        self.pause_cond.notify()
-        self.pause_cond.release()
-
     def __servers_check(self, raise_connection_error: bool = False) -> None:
         """Performs a connect operation to each of them periodically and stores the online servers to the
-        self.online_servers list.
+        self.online_servers list. The list is replaced at once, so the commands that run concurrently always see a
+        consistent snapshot of it.
         :return: None
         """
+        online_servers = []
         for server in self.servers:
             ip, port = server
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
                 try:
                     # Connect to server and send data
                     sock.connect((ip, port))
-                    if server not in self.online_servers:
-                        self.online_servers.append(server)
+                    online_servers.append(server)
                 except (ConnectionRefusedError, ConnectionResetError) as e:
                     if raise_connection_error:
                         raise CustomBrokerConnectionException(
                             f"Server {ip}:{port} not reachable.\n{e}"
                         )
-                    if server in self.online_servers:
-                        self.online_servers.remove(server)
-
-    @staticmethod
-    def __send__(args):
-        """Sends a command to a server and collects the response
-        :param args: Tuple, unpack to ip, port, payload
-        :return: The response of the server
-        """
-        ip, port, payload = args
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            try:
-                # Connect to server and send data
-                sock.connect((ip, port))
-                sock.sendall(bytes(payload + "\n", "utf-8"))
-
-                # Receive data from the server and shut down
-                received = b""
-                while True:
-                    part = sock.recv(1024)
-                    received += part
-                    if len(part) < 1024:
-                        # either 0 or end of data
-                        received = str(received, "utf-8")
-                        break
-
-                return received
-
-            except (ConnectionRefusedError, ConnectionResetError) as e:
-                logger.warning(f"Server {ip}:{port} not reachable\n{e}")
-                return "CONNECTION REFUSED"
+        self.online_servers = online_servers
 
     def __send_request_to_servers(
-        self, payload: str, all_servers: bool = True
-    ) -> List[str]:
-        """Sends a given request to the servers. The send procedure executes in parallel to the servers in order to
-        avoid an iterative approach. This is necessary because we don't maintain the connection to servers throughout
-        the whole runtime of the broker, but we invoke new connections when a new request is inserted.
+        self, payload: str, servers_: List[tuple]
+    ) -> List[Future]:
+        """Sends a given request to the servers over their persistent connections. The requests are pipelined, the
+        method doesn't wait for the responses, so many commands can be in flight to the same servers.
         :param payload: The payload in str in format <CMD> <str(DATA: dict/list)>
-        :param all_servers: Flag that indicates if the operation will be applied to all servers or to some of them
-        (replication factor)
-        :return: A list of the received results
+        :param servers_: The servers to send the request to
+        :return: A list of the futures of the results
         """
-        servers_ = self.online_servers
-        # Choose k random servers
-        if not all_servers and len(self.online_servers) >= self.replication_factor:
-            servers_ = sample(servers_, k=self.replication_factor)
-        # Send requests in parallel
-        params = [(ip, port, payload) for ip, port in servers_]
-        results = self.pool.map(self.__send__, params)
-        return results
+        return [self.connections[server].request(payload) for server in servers_]
+
+    def __least_loaded(self, servers_: List[tuple]) -> List[tuple]:
+        """Chooses the servers of a write. The ties are broken randomly, so the keys are still spread evenly over
+        the servers when the broker is idle.
+        :param servers_: The online servers
+        :return: The k servers with the fewest requests in flight
+        """
+        return sorted(
+            servers_,
+            key=lambda server: (self.connections[server].outstanding, random()),
+        )[: self.replication_factor]
+
+    def __read(
+        self,
+        payload: str,
+        servers_: List[tuple],
+        merge: Callable,
+        complete: Callable,
+        record: bool,
+    ) -> Future:
+        """Sends a read to the fastest servers that hold at least one replica of every key, see ReplicaRead
+        :param payload: The payload in str in format <CMD> <str(DATA: dict/list)>
+        :param servers_: The online servers
+        :param merge: Function that merges the responses to the final result
+        :param complete: Function that tells if a response completes the read by itself
+        :param record: If True the response times feed the hedging threshold
+        :return: A future that resolves to the result
+        """
+        ranked = sorted(
+            (self.connections[server] for server in servers_),
+            key=ServerConnection.expected_latency,
+        )
+        hedge_after = None
+        if self.hedge_percentile is not None:
+            hedge_after = self.latencies.percentile(self.hedge_percentile)
+        return ReplicaRead(
+            payload,
+            ranked,
+            needed=len(self.servers) - self.replication_factor + 1,
+            merge=merge,
+            found=complete,
+            hedge_after=hedge_after,
+            scheduler=self.scheduler,
+            on_latency=self.latencies.add if record else None,
+        ).future
 
     def print_servers_warning(self) -> None:
         """Prints an alert message when the available online servers are less than the replication factor threshold.
@@ -153,52 +176,98 @@ class KeyValueBroker:
                 )
             )
 
-    def execute_command(self, command: str, data: Union[dict, list]) -> Optional[str]:
-        """Executes a parsed command from the CLI
+    def submit_command(self, command: str, data: Union[dict, list]) -> Future:
+        """Submits a parsed command without waiting for its result
         :param command: The validated command
         :param data: The validated data in dictionary type
-        :return: The result
+        :return: A future that resolves to the result
         """
-        # Stop daemon server watchdog
-        self.__pause_watchdog()
+        # Snapshot of the online servers, the watchdog may replace the list in the meantime
+        servers_ = self.online_servers
+        payload = f"{command} {data}"
 
         if command == "PUT":
-            results = self.__send_request_to_servers(
-                f"{command} {data}", all_servers=False
+            # Choose k servers
+            if len(servers_) >= self.replication_factor:
+                if self.latency_aware:
+                    servers_ = self.__least_loaded(servers_)
+                else:
+                    servers_ = sample(servers_, k=self.replication_factor)
+            return gather(
+                self.__send_request_to_servers(payload, servers_), merge_server_results
             )
-        else:
-            # Prevent delete operation when we have even one server down!
-            if command == "DELETE" and (self.online_servers != self.servers):
-                logger.warning(
-                    "WARNING: online servers: {}/{} ABORTING DELETE OPERATION".format(
-                        len(self.online_servers), len(self.servers)
+        elif command in ["STATS", "LOAD", "SNAPSHOT", "PROFILE", "TIMERS"]:
+            if command == "SNAPSHOT" or (command == "PROFILE" and len(data) == 3):
+                # Every server writes its own files, named after the server in case they share a filesystem
+                futures = [
+                    self.connections[server].request(
+                        f"{command} {data[:-1] + [f'{data[-1]}.{server[0]}_{server[1]}']}"
                     )
+                    for server in servers_
+                ]
+            else:
+                futures = self.__send_request_to_servers(payload, servers_)
+            # Statistics are reported per server and not merged
+            return gather(
+                futures,
+                lambda results: "\n".join(
+                    f"{ip}:{port} {result}"
+                    for (ip, port), result in zip(servers_, results)
+                ),
+            )
+        elif command == "SCAN":
+            # Each server holds a part of the keyspace
+            if self.latency_aware:
+                return self.__read(
+                    payload, servers_, merge_scan_results, lambda _: False, False
                 )
-                # Resume daemon
-                self.__resume_watchdog()
-                return None
-
-            results = self.__send_request_to_servers(
-                f"{command} {data}", all_servers=True
+            return gather(
+                self.__send_request_to_servers(payload, servers_), merge_scan_results
             )
 
-        # Resume daemon
-        self.__resume_watchdog()
+        # Prevent delete operation when we have even one server down!
+        if command == "DELETE" and (servers_ != self.servers):
+            logger.warning(
+                "WARNING: online servers: {}/{} ABORTING DELETE OPERATION".format(
+                    len(servers_), len(self.servers)
+                )
+            )
+            future = Future()
+            future.set_result(None)
+            return future
+        if command in ["GET", "QUERY"] and self.latency_aware:
+            return self.__read(payload, servers_, merge_server_results, found, True)
+        return gather(
+            self.__send_request_to_servers(payload, servers_), merge_server_results
+        )
 
-        return merge_server_results(results)
+    def execute_command(self, command: str, data: Union[dict, list]) -> Optional[str]:
+        """Executes a parsed command from the CLI
+        :param command: The validated command
+        :param data: The validated data in dictionary type
+        :return: The result
+        """
+        return self.submit_command(command, data).result()
 
     def index_procedure(self, data: List[tuple]) -> None:
-        """Performs indexing operation when a data file is given
+        """Performs indexing operation when a data file is given. The PUT commands are pipelined, up to
+        INDEX_PIPELINE_DEPTH of them are in flight at the same time.
         :param data: The validated list of tuples that contains the data
         :return: None
         """
-        # Stop daemon server watchdog
-        self.__pause_watchdog()
-
-        # Send data to servers
+        in_flight = []
         for line in data:
-            payload = f"PUT {line}"
-            self.__send_request_to_servers(payload, all_servers=False)
+            in_flight.append(self.submit_command("PUT", line))
+            if len(in_flight) == INDEX_PIPELINE_DEPTH:
+                for future in in_flight:
+                    future.result()
+                in_flight = []
+        for future in in_flight:
+            future.result()
 
-        # Resume daemon
-        self.__resume_watchdog()
+    def close(self) -> None:
+        """Closes the connections to the servers
+        :return: None
+        """
+        for connection in self.connections.values():
+            connection.close()
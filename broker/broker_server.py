@@ -0,0 +1,140 @@
+import logging
+import queue
+import threading as td
+
+from concurrent.futures import Future
+from socketserver import ThreadingTCPServer
+from typing import Tuple
+
+from broker.broker import KeyValueBroker
+from tools.general_tools import (
+    validate_ip_port,
+    parse_command,
+    CustomValidationException,
+    PipelinedRequestHandler,
+)
+
+logger = logging.getLogger(__name__)
+
+# Default number of commands of a client that may wait for their results before the broker stops reading from it
+MAX_PENDING = 128
+
+
+def flatten_response(result: str) -> str:
+    """The responses are newline terminated, so the multi-line ones (e.g. the per server STATS) are flattened to a
+    single line
+    :param result: The result of a command
+    :return: The single line response
+    """
+    return " | ".join(result.splitlines())
+
+
+class BrokerRequestHandler(PipelinedRequestHandler):
+    """Serves a client of the broker. The client may pipeline its commands: they are submitted as soon as they are
+    read and the responses are written in the order of the commands by a separate writer thread. Up to max_pending
+    commands may wait for their results; then the handler blocks and stops reading, so the TCP flow control
+    pushes back to the client instead of the broker buffering without a limit.
+    """
+
+    def handle(self):
+        pending = queue.Queue(maxsize=self.server.max_pending)
+        writer = td.Thread(
+            name=f"writer-{self.client_address[0]}:{self.client_address[1]}",
+            target=self.write_responses,
+            args=(pending,),
+            daemon=True,
+        )
+        writer.start()
+        try:
+            for line in self.rfile:
+                user_command = str(line, "utf-8").strip()
+                if not user_command:
+                    continue
+                pending.put(self.server.submit(self.client_address, user_command))
+                if not writer.is_alive():
+                    # The client doesn't read its responses anymore
+                    break
+        except OSError as e:
+            logger.warning(f"Client {self.client_address} disconnected\n{e}")
+        finally:
+            # Sentinel, the writer exits when all the responses have been written
+            pending.put(None)
+            writer.join()
+
+    def write_responses(self, pending: queue.Queue) -> None:
+        """Writer thread that waits for the results of the pending commands and writes them in order
+        :param pending: The queue of the futures of the pending commands
+        :return: None
+        """
+        while True:
+            future = pending.get()
+            if future is None:
+                return
+            result = future.result()
+            response = flatten_response(result) if result is not None else "ERROR"
+            try:
+                self.wfile.write(bytes(response + "\n", "utf-8"))
+            except OSError as e:
+                logger.warning(f"Client {self.client_address} disconnected\n{e}")
+                # Drain the queue so the reading side never blocks on a full queue
+                while pending.get() is not None:
+                    continue
+                return
+
+
+class KeyValueBrokerServer(ThreadingTCPServer):
+    """Exposes a broker over TCP, so many clients can share its connections to the servers. The clients send the
+    commands of the broker prompt, one per line, and receive one response line per command.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        server_address: Tuple[str, int],
+        broker: KeyValueBroker,
+        max_pending: int = MAX_PENDING,
+    ):
+        """
+        :param server_address: The IP address & port to listen to
+        :param broker: The broker that executes the commands
+        :param max_pending: Number of commands of a client that may wait for their results
+        """
+        validate_ip_port(*server_address)
+        if max_pending < 1:
+            raise CustomValidationException("max_pending should be at least 1")
+        super().__init__(
+            server_address=server_address, RequestHandlerClass=BrokerRequestHandler
+        )
+        self.broker = broker
+        self.max_pending = max_pending
+
+    def serve(self):
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        self.server_close()
+        self.broker.close()
+
+    def submit(self, client_address: Tuple[str, int], user_command: str) -> Future:
+        """Parses a command of a client and submits it to the broker
+        :param client_address: The address of the client
+        :param user_command: The command in the syntax of the broker prompt
+        :return: A future that resolves to the result
+        """
+        try:
+            serialized_cmd = parse_command(user_command)
+            logger.info(f"Broker received from client {client_address}: {user_command}")
+            return self.broker.submit_command(*serialized_cmd)
+        except CustomValidationException as e:
+            logger.warning(f"Client {client_address}: {e}")
+            reason = e
+        except Exception as e:
+            # Any other failure is answered too, so the client connection & its pipelined commands survive
+            logger.exception(f"Client {client_address}: {user_command} failed")
+            reason = f"{type(e).__name__}: {e}"
+        future = Future()
+        future.set_result(f"ERROR {reason}")
+        return future
@@ -0,0 +1,188 @@
+import logging
+import socket
+import threading as td
+import time
+
+from collections import deque
+from concurrent.futures import Future
+from typing import Tuple, List, Callable, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest response time in the moving average of the response times of a server
+EWMA_ALPHA = 0.2
+
+
+class ServerConnection:
+    """Persistent connection of the broker to a server, shared by all the commands that the broker executes. The
+    requests are pipelined: they are written as soon as they are submitted and the server responds to them in
+    order, so a reader thread resolves the pending futures one by one as the responses arrive.
+    """
+
+    def __init__(self, server: Tuple[str, int]):
+        self.server = server
+        # Exponentially weighted moving average of the response times in seconds & number of requests in flight
+        self.ewma = 0.0
+        self.outstanding = 0
+        self.stats_lock = td.Lock()
+        self.sock = None
+        self.pending = deque()
+        # Keeps the order of the written requests equal to the order of the pending futures
+        self.send_lock = td.Lock()
+        # Guards the connection state. It is never held while blocking on the socket, so the reader thread is
+        # always able to drain the responses.
+        self.lock = td.Lock()
+
+    def __connect(self) -> None:
+        """Opens the connection and starts the reader thread. Called with the lock held.
+        :return: None
+        """
+        self.sock = socket.create_connection(self.server)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Every connection has its own queue, so a broken connection never resolves the futures of the next one
+        self.pending = deque()
+        reader = td.Thread(
+            name=f"reader-{self.server[0]}:{self.server[1]}",
+            target=self.__read_responses,
+            args=(self.sock, self.pending),
+            daemon=True,
+        )
+        reader.start()
+
+    def __read_responses(self, sock: socket.socket, pending: deque) -> None:
+        """Reader thread that resolves the pending futures with the newline terminated responses of the server
+        :param sock: The socket of the connection
+        :param pending: The pending futures of the connection
+        :return: None
+        """
+        try:
+            with sock.makefile("rb") as rfile:
+                for line in rfile:
+                    pending.popleft().set_result(str(line, "utf-8").strip())
+        except (OSError, IndexError) as e:
+            # A closed connection may still be drained of the responses of the abandoned hedged reads
+            if self.sock is sock:
+                logger.warning(
+                    f"Server {self.server[0]}:{self.server[1]} not reachable\n{e}"
+                )
+        self.__fail_pending(sock, pending)
+
+    def __fail_pending(self, sock: socket.socket, pending: deque) -> None:
+        """Drops a broken connection and resolves all its pending futures as refused
+        :param sock: The socket of the broken connection
+        :param pending: The pending futures of the broken connection
+        :return: None
+        """
+        with self.lock:
+            if self.sock is sock:
+                self.sock = None
+        try:
+            sock.close()
+        except OSError:
+            pass
+        while True:
+            try:
+                future = pending.popleft()
+            except IndexError:
+                break
+            future.set_result("CONNECTION REFUSED")
+
+    def request(
+        self, payload: str, on_latency: Optional[Callable[[float], None]] = None
+    ) -> Future:
+        """Sends a command to the server without waiting for the response
+        :param payload: The payload in str in format <CMD> <str(DATA: dict/list)>
+        :param on_latency: Optional function that is called with the response time if the server answers
+        :return: A future that resolves to the response of the server
+        """
+        future = Future()
+        sent = time.perf_counter()
+        with self.stats_lock:
+            self.outstanding += 1
+        future.add_done_callback(
+            lambda future_: self.__record(sent, future_, on_latency)
+        )
+        with self.send_lock:
+            with self.lock:
+                try:
+                    if self.sock is None:
+                        self.__connect()
+                except OSError as e:
+                    logger.warning(
+                        f"Server {self.server[0]}:{self.server[1]} not reachable\n{e}"
+                    )
+                    future.set_result("CONNECTION REFUSED")
+                    return future
+                sock, pending = self.sock, self.pending
+            pending.append(future)
+            try:
+                sock.sendall(bytes(payload + "\n", "utf-8"))
+            except OSError as e:
+                logger.warning(
+                    f"Server {self.server[0]}:{self.server[1]} not reachable\n{e}"
+                )
+                self.__fail_pending(sock, pending)
+        return future
+
+    def __record(
+        self,
+        sent: float,
+        future: Future,
+        on_latency: Optional[Callable[[float], None]],
+    ) -> None:
+        """Updates the load & the response time statistics when a request completes
+        :param sent: The perf_counter() value when the request was submitted
+        :param future: The completed future of the request
+        :param on_latency: Optional function that is called with the response time
+        :return: None
+        """
+        latency = time.perf_counter() - sent
+        with self.stats_lock:
+            self.outstanding -= 1
+            if future.result() == "CONNECTION REFUSED":
+                return
+            if self.ewma:
+                self.ewma += EWMA_ALPHA * (latency - self.ewma)
+            else:
+                self.ewma = latency
+        if on_latency is not None:
+            on_latency(latency)
+
+    def expected_latency(self) -> float:
+        """The expected response time of a new request, the queued requests are served before it
+        :return: The estimation in seconds
+        """
+        return self.ewma * (self.outstanding + 1)
+
+    def close(self) -> None:
+        with self.lock:
+            sock, pending = self.sock, self.pending
+        if sock is not None:
+            self.__fail_pending(sock, pending)
+
+
+def gather(futures: List[Future], merge: Callable[[List[str]], Any]) -> Future:
+    """Combines the futures of a command that was sent to many servers
+    :param futures: The futures of the responses of the servers
+    :param merge: Function that merges the list of the responses to the final result
+    :return: A future that resolves to the merged result when all the responses have arrived
+    """
+    combined = Future()
+    remaining = [len(futures)]
+    lock = td.Lock()
+
+    def on_done(_: Future) -> None:
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            combined.set_result(merge([future.result() for future in futures]))
+        except Exception as e:
+            combined.set_exception(e)
+
+    if not futures:
+        combined.set_result(merge([]))
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
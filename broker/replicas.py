@@ -0,0 +1,199 @@
+import heapq
+import itertools
+import logging
+import threading as td
+import time
+
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+from broker.connection import ServerConnection
+
+logger = logging.getLogger(__name__)
+
+# Number of recent response times that the hedging threshold is computed from
+LATENCY_WINDOW = 1000
+
+# The percentiles are recomputed after this number of new response times
+LATENCY_REFRESH = 100
+
+# No hedging until this number of response times has been collected
+LATENCY_MIN_SAMPLES = 50
+
+
+class LatencyWindow:
+    """The recent response times of the servers to GET & QUERY, used to compute the hedging threshold. The other
+    commands are not recorded, e.g. a LOAD that takes seconds would switch off the hedging of the reads.
+    """
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self.lock = td.Lock()
+        self.samples = deque(maxlen=size)
+        self.added = 0
+        # The percentiles are cached, sorting the window for every read would cost more than the reads
+        self.percentiles = dict()
+
+    def add(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+            self.added += 1
+            if self.added % LATENCY_REFRESH == 0:
+                self.percentiles.clear()
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """
+        :param percentile: The percentile, e.g. 95
+        :return: The response time in seconds or None if there are not enough samples yet
+        """
+        with self.lock:
+            if len(self.samples) < LATENCY_MIN_SAMPLES:
+                return None
+            value = self.percentiles.get(percentile)
+            if value is None:
+                samples = sorted(self.samples)
+                index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+                value = self.percentiles[percentile] = samples[index]
+            return value
+
+
+class Scheduler:
+    """Runs callbacks after a delay on a single thread, which is much cheaper than a threading.Timer per read"""
+
+    def __init__(self):
+        self.condition = td.Condition()
+        self.heap = list()
+        self.counter = itertools.count()
+        td.Thread(name="hedging-scheduler", target=self.run, daemon=True).start()
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> None:
+        with self.condition:
+            heapq.heappush(
+                self.heap, (time.monotonic() + delay, next(self.counter), callback)
+            )
+            self.condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.heap:
+                    self.condition.wait()
+                deadline, _, callback = self.heap[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+            # A failed callback must not stop the thread, the later reads would never be hedged
+            try:
+                callback()
+            except Exception:
+                logger.exception("Scheduled callback failed")
+
+
+class ReplicaRead:
+    """A read that is sent to the fastest servers that are enough to cover all the keys. Every key is stored to k of
+    the N servers, so any N - k + 1 servers hold at least one replica of it. The read completes as soon as a server
+    finds the value, or when enough servers have answered that it doesn't exist. If a server refuses the read, or
+    hasn't answered by the hedging threshold, the read is sent to the next fastest server too.
+    """
+
+    def __init__(
+        self,
+        payload: str,
+        ranked: List[ServerConnection],
+        needed: int,
+        merge: Callable[[List[str]], str],
+        found: Callable[[str], bool],
+        hedge_after: Optional[float] = None,
+        scheduler: Optional[Scheduler] = None,
+        on_latency: Optional[Callable[[float], None]] = None,
+    ):
+        """
+        :param payload: The payload in str in format <CMD> <str(DATA: dict/list)>
+        :param ranked: The connections of the online servers, the fastest first
+        :param needed: The number of servers that have to answer
+        :param merge: Function that merges the responses to the final result
+        :param found: Function that tells if a response completes the read by itself
+        :param hedge_after: Seconds after which the read is sent to one more server, None disables hedging
+        :param scheduler: The scheduler of the hedged requests
+        :param on_latency: Optional function that is called with the response time of every server that answers
+        """
+        self.payload = payload
+        self.ranked = ranked
+        self.needed = min(needed, len(ranked))
+        self.merge = merge
+        self.found = found
+        self.on_latency = on_latency
+        self.future = Future()
+        self.lock = td.Lock()
+        self.responses = list()
+        self.answered = 0
+        self.sent = 0
+        self.hedged = False
+        # Set by the response that completes the read, the future itself is resolved outside the lock
+        self.completed = False
+
+        # The servers are claimed before any request is sent, a fast response may fail over meanwhile
+        with self.lock:
+            initial = self.ranked[: self.needed]
+            self.sent = self.needed
+        for connection in initial:
+            self.__send(connection)
+        if not ranked:
+            self.future.set_result(merge([]))
+        elif hedge_after is not None and self.needed < len(ranked):
+            scheduler.call_later(hedge_after, self.hedge)
+
+    def __claim_next(self) -> Optional[ServerConnection]:
+        """Claims the next fastest server that the read hasn't been sent to. Must be called with the lock held, in
+        the same critical section that decides to send, or a failover & a hedge could claim the same server.
+        :return: The connection or None if the read has been sent to all the servers
+        """
+        if self.sent >= len(self.ranked):
+            return None
+        connection = self.ranked[self.sent]
+        self.sent += 1
+        return connection
+
+    def __send(self, connection: ServerConnection) -> None:
+        # Sent outside the lock, the callback runs at once if the connection refuses the request
+        connection.request(self.payload, self.on_latency).add_done_callback(
+            self.on_response
+        )
+
+    def on_response(self, future: Future) -> None:
+        result = future.result()
+        connection = None
+        with self.lock:
+            if self.completed:
+                return
+            self.responses.append(result)
+            if result != "CONNECTION REFUSED":
+                self.answered += 1
+            else:
+                connection = self.__claim_next()
+            done = connection is None and (
+                self.found(result)
+                or self.answered >= self.needed
+                or len(self.responses) == len(self.ranked)
+            )
+            self.completed = done
+            responses = list(self.responses)
+        if connection is not None:
+            self.__send(connection)
+        elif done:
+            try:
+                self.future.set_result(self.merge(responses))
+            except Exception as e:
+                self.future.set_exception(e)
+
+    def hedge(self) -> None:
+        with self.lock:
+            if self.completed:
+                return
+            connection = self.__claim_next()
+            if connection is None:
+                return
+            self.hedged = True
+        self.__send(connection)
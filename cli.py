@@ -1,11 +1,14 @@
 import logging
+import os
 import sys
 import click
 
 from data_generator.data_generator import generated_key_value_pairs
 from broker.broker import KeyValueBroker
+from broker.broker_server import KeyValueBrokerServer, MAX_PENDING
 from loggers.custom_loggers import setup_logger
 from server.server import KeyValueServer
+from server.sharded_server import ShardedKeyValueServer
 from tools.general_tools import (
     read_keys_and_types_from_file,
     list_of_dicts_to_file,
@@ -87,13 +90,58 @@ def create_data(n, d, m, l, k):
     "-a", prompt=True, required=True, type=click.STRING, help="The IP address"
 )
 @click.option("-p", prompt=True, required=True, type=click.INT, help="The port")
+@click.option(
+    "-w",
+    "--workers",
+    default=1,
+    type=click.INT,
+    help="Number of worker processes, each one owning a shard of the keyspace",
+)
+@click.option(
+    "--preload",
+    required=False,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Data file to bulk load before serving, inside the data directory",
+)
+@click.option(
+    "--data-dir",
+    default=".",
+    type=click.Path(exists=True, file_okay=False),
+    help="Directory of the files of the LOAD, SNAPSHOT & PROFILE commands, the clients can't access other files",
+)
+@click.option(
+    "--copy-on-write/--in-place",
+    default=True,
+    help="Copy-on-write Trie, so every command reads a point-in-time view, or an in-place Trie with about twice the "
+    "write throughput",
+)
 @cli.command()
-def kv_server(a, p):
+def kv_server(a, p, workers, preload, data_dir, copy_on_write):
     # Set up logger
     setup_logger(server=True)
-    logging.getLogger(__name__)
-    validate_ip_port(ip_address=a, port=p)
-    server = KeyValueServer(server_address=(a, p))
+    logger = logging.getLogger(__name__)
+    try:
+        validate_ip_port(ip_address=a, port=p)
+        if workers > 1:
+            server = ShardedKeyValueServer(
+                server_address=(a, p),
+                workers=workers,
+                data_dir=data_dir,
+                copy_on_write=copy_on_write,
+            )
+        else:
+            server = KeyValueServer(
+                server_address=(a, p), data_dir=data_dir, copy_on_write=copy_on_write
+            )
+    except (CustomValidationException, CustomBrokerConnectionException) as e:
+        logger.error(f"{e}")
+        sys.exit(1)
+
+    if preload:
+        logger.info(f"Loading data from {preload}...")
+        # The servers resolve the paths under the data directory
+        preload = os.path.relpath(os.path.realpath(preload), os.path.realpath(data_dir))
+        logger.info(f"Loaded: {server.preload(preload)}")
     server.serve()
 
 
@@ -115,8 +163,32 @@ def kv_server(a, p):
     help="Replication factor, how many different"
     "servers will have the same replicated data",
 )
+@click.option(
+    "--listen-ip",
+    default="127.0.0.1",
+    type=click.STRING,
+    help="The IP address to accept clients on, used with --listen-port",
+)
+@click.option(
+    "--listen-port",
+    required=False,
+    type=click.INT,
+    help="Serve clients on this port instead of starting the command prompt",
+)
+@click.option(
+    "--max-pending",
+    default=MAX_PENDING,
+    type=click.INT,
+    help="Number of commands of a client that may wait for their results before the broker stops reading from it",
+)
+@click.option(
+    "--hedge-percentile",
+    required=False,
+    type=click.FLOAT,
+    help="Send a read to one more server when it hasn't been answered by this percentile of the response times",
+)
 @cli.command()
-def kv_broker(s, i, k):
+def kv_broker(s, i, k, listen_ip, listen_port, max_pending, hedge_percentile):
     # Set up logger
     setup_logger(server=False)
     logger = logging.getLogger(__name__)
@@ -129,7 +201,9 @@ def kv_broker(s, i, k):
         sys.exit(1)
 
     try:
-        broker = KeyValueBroker(servers=servers, replication_factor=k)
+        broker = KeyValueBroker(
+            servers=servers, replication_factor=k, hedge_percentile=hedge_percentile
+        )
     except (CustomBrokerConnectionException, CustomValidationException) as e:
         logger.error(f"{e}")
         sys.exit(1)
@@ -140,6 +214,20 @@ def kv_broker(s, i, k):
         logger.info("Sending data to servers...")
         broker.index_procedure(serialized_data_to_index)
 
+    if listen_port is not None:
+        try:
+            broker_server = KeyValueBrokerServer(
+                server_address=(listen_ip, listen_port),
+                broker=broker,
+                max_pending=max_pending,
+            )
+        except (CustomValidationException, OSError) as e:
+            logger.error(f"{e}")
+            sys.exit(1)
+        logger.info(f"Serving clients at {listen_ip}:{listen_port}")
+        broker_server.serve()
+        return
+
     while True:
         user_command = input(">: ")
         broker.print_servers_warning()
@@ -0,0 +1,259 @@
+import asyncio
+
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Tuple, Union
+
+from client.protocol import (
+    KeyValueCommands,
+    encode_command,
+    decode_response,
+    decode_responses,
+    RETRIED_COMMANDS,
+    ADMIN_COMMANDS,
+    CustomServerUnavailableException,
+    CustomRequestFailedException,
+)
+from tools.general_tools import validate_ip_port
+
+
+class AsyncConnection:
+    """An asyncio connection to a server or a broker"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, address: Tuple[str, int]) -> "AsyncConnection":
+        reader, writer = await asyncio.open_connection(*address)
+        return cls(reader, writer)
+
+    async def request(self, payloads: List[str]) -> List[str]:
+        """Sends a batch of commands and waits for their responses
+        :param payloads: The encoded commands
+        :return: The responses in the order of the commands
+        """
+        self.writer.write(
+            bytes("".join(payload + "\n" for payload in payloads), "utf-8")
+        )
+        # The responses are read while the batch is being flushed, so a big batch can't fill the socket buffers
+        drain = asyncio.ensure_future(self.writer.drain())
+        try:
+            responses = list()
+            for _ in payloads:
+                line = await self.reader.readline()
+                if not line.endswith(b"\n"):
+                    raise ConnectionError("Connection closed by the remote end")
+                responses.append(str(line, "utf-8").strip())
+        except BaseException:
+            drain.cancel()
+            raise
+        await drain
+        return responses
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class AsyncConnectionPool:
+    """Pool of asyncio connections to a server or a broker. A connection that fails is closed instead of being
+    returned to the pool.
+    """
+
+    def __init__(self, address: Tuple[str, int], size: int = 8, timeout: float = 5.0):
+        """
+        :param address: The IP address & port of the server or the broker
+        :param size: The maximum number of open connections
+        :param timeout: Seconds to wait for a connection or a free slot of the pool
+        """
+        self.address = address
+        self.size = size
+        self.timeout = timeout
+        self.idle = list()
+        # Created on first use, inside the running event loop
+        self.slots = None
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[AsyncConnection]:
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.size)
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise CustomServerUnavailableException(
+                f"No free connection to {self.address} in {self.timeout} seconds"
+            )
+        try:
+            if self.idle:
+                connection = self.idle.pop()
+            else:
+                connection = await asyncio.wait_for(
+                    AsyncConnection.open(self.address), self.timeout
+                )
+            try:
+                yield connection
+            except BaseException:
+                connection.close()
+                raise
+            self.idle.append(connection)
+        finally:
+            self.slots.release()
+
+    def close(self) -> None:
+        while self.idle:
+            self.idle.pop().close()
+
+
+class AsyncPipeline(KeyValueCommands):
+    """Buffers commands and sends them together over a single connection, so they cost one round trip"""
+
+    def __init__(self, client: "AsyncKeyValueClient"):
+        self.client = client
+        self.commands = list()
+
+    def execute(self, command: str, data: Union[dict, list]) -> "AsyncPipeline":
+        # Validates the command now, so the error points to the call that caused it
+        encode_command(command, data, self.client.broker)
+        self.commands.append((command, data))
+        return self
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    async def run(self, raise_on_error: bool = True) -> List[Any]:
+        """Sends the buffered commands and clears the pipeline
+        :param raise_on_error: If True the first failed command raises its exception, otherwise the exception takes
+        the place of its result
+        :return: The results in the order of the commands
+        """
+        commands, self.commands = self.commands, list()
+        return await self.client.execute_many(commands, raise_on_error)
+
+
+class AsyncKeyValueClient(KeyValueCommands):
+    """asyncio client of a server (also a sharded one) or a broker. The commands are coroutines, e.g.
+
+    >>> client = AsyncKeyValueClient(("127.0.0.1", 9000))
+    >>> await client.put("person1", {"height": 1.75})
+    True
+    >>> await asyncio.gather(*[client.get(f"person{i}") for i in range(100)])
+    """
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        broker: bool = False,
+        pool_size: int = 8,
+        timeout: float = 5.0,
+        admin_timeout: float = 600.0,
+        retries: int = 2,
+        backoff: float = 0.1,
+    ):
+        """
+        :param address: The IP address & port of the server or the broker
+        :param broker: If True the client talks to a broker started with --listen-port, otherwise to a server
+        :param pool_size: The maximum number of open connections
+        :param timeout: Seconds to wait for a connection or a response
+        :param admin_timeout: Seconds to wait for the response of LOAD, SNAPSHOT, PROFILE & TIMERS
+        :param retries: How many times a command is sent again when it couldn't be sent, or a read when its connection
+        fails
+        :param backoff: Seconds to wait before the 1st retry, doubled on every next one
+        """
+        validate_ip_port(*address)
+        self.address = address
+        self.broker = broker
+        self.timeout = timeout
+        self.admin_timeout = admin_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool = AsyncConnectionPool(address, size=pool_size, timeout=timeout)
+
+    async def __aenter__(self) -> "AsyncKeyValueClient":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self.close()
+
+    async def __with_retries(
+        self, function: Callable[[], Awaitable[Any]], commands: List[str]
+    ) -> Any:
+        """Runs a request & retries it if it couldn't be sent. If the connection fails after the request was sent, it
+        is retried only if all the commands are reads, the server may be still executing the others.
+        """
+        attempt = 0
+        while True:
+            try:
+                return await function()
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                CustomServerUnavailableException,
+            ) as e:
+                if isinstance(e, CustomRequestFailedException) and not all(
+                    command in RETRIED_COMMANDS for command in commands
+                ):
+                    raise
+                if attempt >= self.retries:
+                    raise CustomServerUnavailableException(
+                        f"{self.address[0]}:{self.address[1]} failed after {attempt + 1} attempts\n{e}"
+                    ) from e
+                await asyncio.sleep(self.backoff * 2**attempt)
+                attempt += 1
+
+    async def __request(self, payloads: List[str], commands: List[str]) -> List[str]:
+        timeout = (
+            self.admin_timeout
+            if any(command in ADMIN_COMMANDS for command in commands)
+            else self.timeout
+        )
+        async with self.pool.connection() as connection:
+            try:
+                return await asyncio.wait_for(connection.request(payloads), timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                raise CustomRequestFailedException(
+                    f"The connection to {self.address[0]}:{self.address[1]} failed after the command was sent, it "
+                    f"may have been executed\n{e!r}"
+                ) from e
+
+    async def __execute(self, command: str, payload: str) -> Any:
+        return decode_response(
+            command, (await self.__request([payload], [command]))[0], self.broker
+        )
+
+    async def execute(self, command: str, data: Union[dict, list]) -> Any:
+        """Executes a command
+        :param command: The command ('GET', 'PUT', etc.)
+        :param data: The data of the command, a dictionary for PUT and a list for the rest
+        :return: The typed result, see decode_response
+        """
+        payload = encode_command(command, data, self.broker)
+        return await self.__with_retries(
+            lambda: self.__execute(command, payload), [command]
+        )
+
+    async def execute_many(
+        self, commands: List[Tuple[str, Union[dict, list]]], raise_on_error: bool = True
+    ) -> List[Any]:
+        """Executes a batch of commands over a single connection. If the connection fails the whole batch is sent
+        again, if it couldn't be sent or all its commands are reads.
+        :param commands: A list of (command, data) tuples
+        :param raise_on_error: If True the first failed command raises its exception, otherwise the exception takes
+        the place of its result
+        :return: The results in the order of the commands
+        """
+        if not commands:
+            return list()
+        payloads = [
+            encode_command(command, data, self.broker) for command, data in commands
+        ]
+        names = [command for command, _ in commands]
+        responses = await self.__with_retries(
+            lambda: self.__request(payloads, names), names
+        )
+        return decode_responses(commands, responses, self.broker, raise_on_error)
+
+    def pipeline(self) -> AsyncPipeline:
+        return AsyncPipeline(self)
+
+    def close(self) -> None:
+        self.pool.close()
@@ -0,0 +1,269 @@
+import queue
+import socket
+import threading as td
+import time
+
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Union
+
+from client.protocol import (
+    KeyValueCommands,
+    encode_command,
+    decode_response,
+    decode_responses,
+    RETRIED_COMMANDS,
+    ADMIN_COMMANDS,
+    CustomServerUnavailableException,
+    CustomRequestFailedException,
+)
+from tools.general_tools import validate_ip_port
+
+
+class Connection:
+    """A connection to a server or a broker. The commands are newline terminated and so are the responses, which
+    arrive in the order of the commands.
+    """
+
+    def __init__(self, address: Tuple[str, int], timeout: float):
+        self.sock = socket.create_connection(address, timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile("rb")
+
+    def request(
+        self, payloads: List[str], timeout: Optional[float] = None
+    ) -> List[str]:
+        """Sends a batch of commands and waits for their responses
+        :param payloads: The encoded commands
+        :param timeout: Seconds to wait for the responses instead of the timeout of the connection
+        :return: The responses in the order of the commands
+        """
+        if timeout is not None:
+            default = self.sock.gettimeout()
+            self.sock.settimeout(timeout)
+            try:
+                return self.request(payloads)
+            finally:
+                self.sock.settimeout(default)
+        data = bytes("".join(payload + "\n" for payload in payloads), "utf-8")
+        if len(payloads) == 1:
+            self.sock.sendall(data)
+        else:
+            # The responses of a big batch may fill the socket buffers before all the commands are written, so the
+            # batch is written by another thread while this one reads
+            errors = list()
+            sender = td.Thread(target=self.__send, args=(data, errors), daemon=True)
+            sender.start()
+        try:
+            responses = list()
+            for _ in payloads:
+                line = self.rfile.readline()
+                if not line.endswith(b"\n"):
+                    raise ConnectionError("Connection closed by the remote end")
+                responses.append(str(line, "utf-8").strip())
+        finally:
+            if len(payloads) > 1:
+                sender.join()
+        if len(payloads) > 1 and errors:
+            raise errors[0]
+        return responses
+
+    def __send(self, data: bytes, errors: list) -> None:
+        try:
+            self.sock.sendall(data)
+        except OSError as e:
+            errors.append(e)
+            # Unblocks the reading side
+            self.sock.shutdown(socket.SHUT_RDWR)
+
+    def close(self) -> None:
+        self.rfile.close()
+        self.sock.close()
+
+
+class ConnectionPool:
+    """Thread safe pool of connections to a server or a broker. A connection that fails is closed instead of being
+    returned to the pool, so a broken or out of sync connection is never reused.
+    """
+
+    def __init__(self, address: Tuple[str, int], size: int = 8, timeout: float = 5.0):
+        """
+        :param address: The IP address & port of the server or the broker
+        :param size: The maximum number of open connections
+        :param timeout: Seconds to wait for a connection, a free slot of the pool or a response
+        """
+        self.address = address
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = td.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        if not self.slots.acquire(timeout=self.timeout):
+            raise CustomServerUnavailableException(
+                f"No free connection to {self.address} in {self.timeout} seconds"
+            )
+        try:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                connection = Connection(self.address, self.timeout)
+            try:
+                yield connection
+            except BaseException:
+                connection.close()
+                raise
+            self.idle.put(connection)
+        finally:
+            self.slots.release()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class Pipeline(KeyValueCommands):
+    """Buffers commands and sends them together over a single connection, so they cost one round trip"""
+
+    def __init__(self, client: "KeyValueClient"):
+        self.client = client
+        self.commands = list()
+
+    def execute(self, command: str, data: Union[dict, list]) -> "Pipeline":
+        # Validates the command now, so the error points to the call that caused it
+        encode_command(command, data, self.client.broker)
+        self.commands.append((command, data))
+        return self
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def run(self, raise_on_error: bool = True) -> List[Any]:
+        """Sends the buffered commands and clears the pipeline
+        :param raise_on_error: If True the first failed command raises its exception, otherwise the exception takes
+        the place of its result
+        :return: The results in the order of the commands
+        """
+        commands, self.commands = self.commands, list()
+        return self.client.execute_many(commands, raise_on_error)
+
+
+class KeyValueClient(KeyValueCommands):
+    """Client of a server (also a sharded one) or a broker.
+
+    >>> client = KeyValueClient(("127.0.0.1", 9000))
+    >>> client.put("person1", {"height": 1.75})
+    True
+    >>> client.query("person1", "height")
+    1.75
+    """
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        broker: bool = False,
+        pool_size: int = 8,
+        timeout: float = 5.0,
+        admin_timeout: float = 600.0,
+        retries: int = 2,
+        backoff: float = 0.1,
+    ):
+        """
+        :param address: The IP address & port of the server or the broker
+        :param broker: If True the client talks to a broker started with --listen-port, otherwise to a server
+        :param pool_size: The maximum number of open connections
+        :param timeout: Seconds to wait for a connection or a response
+        :param admin_timeout: Seconds to wait for the response of LOAD, SNAPSHOT, PROFILE & TIMERS
+        :param retries: How many times a command is sent again when it couldn't be sent, or a read when its connection
+        fails
+        :param backoff: Seconds to wait before the 1st retry, doubled on every next one
+        """
+        validate_ip_port(*address)
+        self.address = address
+        self.broker = broker
+        self.admin_timeout = admin_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool = ConnectionPool(address, size=pool_size, timeout=timeout)
+
+    def __enter__(self) -> "KeyValueClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __with_retries(self, function: Callable[[], Any], commands: List[str]) -> Any:
+        """Runs a request & retries it if it couldn't be sent. If the connection fails after the request was sent, it
+        is retried only if all the commands are reads, the server may be still executing the others.
+        """
+        attempt = 0
+        while True:
+            try:
+                return function()
+            except (OSError, CustomServerUnavailableException) as e:
+                if isinstance(e, CustomRequestFailedException) and not all(
+                    command in RETRIED_COMMANDS for command in commands
+                ):
+                    raise
+                if attempt >= self.retries:
+                    raise CustomServerUnavailableException(
+                        f"{self.address[0]}:{self.address[1]} failed after {attempt + 1} attempts\n{e}"
+                    ) from e
+                time.sleep(self.backoff * 2**attempt)
+                attempt += 1
+
+    def __request(self, payloads: List[str], commands: List[str]) -> List[str]:
+        timeout = (
+            self.admin_timeout
+            if any(command in ADMIN_COMMANDS for command in commands)
+            else None
+        )
+        with self.pool.connection() as connection:
+            try:
+                return connection.request(payloads, timeout)
+            except OSError as e:
+                raise CustomRequestFailedException(
+                    f"The connection to {self.address[0]}:{self.address[1]} failed after the command was sent, it "
+                    f"may have been executed\n{e}"
+                ) from e
+
+    def execute(self, command: str, data: Union[dict, list]) -> Any:
+        """Executes a command
+        :param command: The command ('GET', 'PUT', etc.)
+        :param data: The data of the command, a dictionary for PUT and a list for the rest
+        :return: The typed result, see decode_response
+        """
+        payload = encode_command(command, data, self.broker)
+        return self.__with_retries(
+            lambda: decode_response(
+                command, self.__request([payload], [command])[0], self.broker
+            ),
+            [command],
+        )
+
+    def execute_many(
+        self, commands: List[Tuple[str, Union[dict, list]]], raise_on_error: bool = True
+    ) -> List[Any]:
+        """Executes a batch of commands over a single connection. If the connection fails the whole batch is sent
+        again, if it couldn't be sent or all its commands are reads.
+        :param commands: A list of (command, data) tuples
+        :param raise_on_error: If True the first failed command raises its exception, otherwise the exception takes
+        the place of its result
+        :return: The results in the order of the commands
+        """
+        if not commands:
+            return list()
+        payloads = [
+            encode_command(command, data, self.broker) for command, data in commands
+        ]
+        names = [command for command, _ in commands]
+        responses = self.__with_retries(lambda: self.__request(payloads, names), names)
+        return decode_responses(commands, responses, self.broker, raise_on_error)
+
+    def pipeline(self) -> Pipeline:
+        return Pipeline(self)
+
+    def close(self) -> None:
+        self.pool.close()
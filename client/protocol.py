@@ -0,0 +1,194 @@
+from abc import ABC, abstractmethod
+from typing import Any, List, Tuple, Union, Optional
+
+from tools.command_parser import parse_data, CustomParsingException
+from tools.general_tools import parse_command, parse_command_for_server
+
+
+class CustomClientException(Exception):
+    pass
+
+
+class CustomCommandException(CustomClientException):
+    """The server or the broker refused the command"""
+
+    pass
+
+
+class CustomServerUnavailableException(CustomClientException):
+    """The server, or all the servers of the broker, could not be reached"""
+
+    pass
+
+
+class CustomRequestFailedException(CustomServerUnavailableException):
+    """The connection failed after the command was sent, so the command may have been executed"""
+
+    pass
+
+
+# The reads, sent again if the connection fails after they were sent. Any other command is sent again only if it
+# wasn't sent at all, e.g. a DELETE that timed out may have deleted the key.
+RETRIED_COMMANDS = ["GET", "QUERY", "SCAN", "STATS"]
+
+# The commands that may take long, e.g. a LOAD of a big file, wait with the admin timeout of the clients
+ADMIN_COMMANDS = ["LOAD", "SNAPSHOT", "PROFILE", "TIMERS"]
+
+
+def encode_command(command: str, data: Union[dict, list], broker: bool = False) -> str:
+    """Encodes a command to the grammar of its receiver and validates it with the parser of the receiver, so a
+    malformed command fails at the client before it is sent.
+    :param command: The command ('GET', 'PUT', etc.)
+    :param data: The data of the command, a dictionary for PUT and a list for the rest
+    :param broker: If True the command is encoded to the syntax of the broker prompt, otherwise to the socket level
+    syntax of the servers
+    :return: The encoded command
+    """
+    if not broker:
+        payload = f"{command} {data}"
+        parse_command_for_server(payload)
+        return payload
+
+    if command == "PUT":
+        # The pairs without the enclosing curly brackets: 'key': {'key1': 'value'}
+        payload = f"PUT {str(data)[1:-1]}"
+    elif command == "QUERY":
+        payload = f"QUERY {'.'.join(data)}"
+    elif command in ["STATS", "PROFILE", "TIMERS"]:
+        payload = " ".join([command] + data)
+    else:
+        payload = f"{command} {data[0]}" if data else command
+    parse_command(payload)
+    return payload
+
+
+def decode_value(response: str) -> Any:
+    """Decodes a found value. The servers render the values with repr(), so the strings are quoted and every value
+    is decoded to its stored type.
+    :param response: The response of a GET or QUERY command
+    :return: The value
+    """
+    values = parse_data(f"[{response}]")
+    if len(values) != 1:
+        raise CustomParsingException(f"Expected a single value, found {response!r}", 0)
+    return values[0]
+
+
+def decode_per_server(response: str) -> dict:
+    """Decodes the responses of a broker that report every server separately:
+    "127.0.0.1:9000 {'records': 2} | 127.0.0.1:9001 CONNECTION REFUSED"
+    :param response: The response of the broker
+    :return: A dictionary of the results per server, None for the servers that failed
+    """
+    results = dict()
+    for line in response.replace(" | ", "\n").splitlines():
+        server, _, result = line.partition(" ")
+        if result == "OK":
+            results[server] = True
+        elif result.startswith("{") or result.startswith("["):
+            results[server] = parse_data(result)
+        else:
+            results[server] = None
+    return results
+
+
+def decode_response(command: str, response: str, broker: bool = False) -> Any:
+    """Decodes the response of a server or a broker to a typed result
+    :param command: The command that was sent
+    :param response: The response line
+    :param broker: If True the response is of a broker
+    :return: The value for GET & QUERY (None if not found), True/False for PUT & DELETE, a dictionary for SCAN (empty if
+    not found), STATS, LOAD & the TIMERS report, the list of the written files for PROFILE stop and True for the rest.
+    A broker reports the results per server.
+    """
+    if response in ["CONNECTION REFUSED", ""]:
+        raise CustomServerUnavailableException(f"{command} failed: no server reachable")
+    if response in ["ERROR", "WRONG SHARD"] or response.startswith("ERROR "):
+        raise CustomCommandException(f"{command} failed: {response}")
+
+    try:
+        if command in ["STATS", "LOAD", "SNAPSHOT", "PROFILE", "TIMERS"]:
+            if broker:
+                return decode_per_server(response)
+            return True if response == "OK" else parse_data(response)
+        if response == "NOT FOUND":
+            return {"GET": None, "QUERY": None, "DELETE": False, "SCAN": dict()}[
+                command
+            ]
+        if command in ["PUT", "DELETE"]:
+            return response == "OK"
+        if command == "SCAN":
+            return parse_data(response)
+        return decode_value(response)
+    except (CustomParsingException, KeyError) as e:
+        raise CustomCommandException(f"{command} failed: unexpected response {e}")
+
+
+class KeyValueCommands(ABC):
+    """The commands of the store on top of an execute(command, data) method. The clients return the results of the
+    commands, the pipelines buffer them.
+    """
+
+    @abstractmethod
+    def execute(self, command: str, data: Union[dict, list]) -> Any:
+        pass
+
+    def get(self, key: str) -> Any:
+        return self.execute("GET", [key])
+
+    def query(self, *keys: str) -> Any:
+        return self.execute("QUERY", list(keys))
+
+    def put(self, key: str, value: dict) -> Any:
+        return self.execute("PUT", {key: value})
+
+    def delete(self, key: str) -> Any:
+        return self.execute("DELETE", [key])
+
+    def scan(self, prefix: str = "") -> Any:
+        return self.execute("SCAN", [prefix])
+
+    def stats(self) -> Any:
+        return self.execute("STATS", [])
+
+    def load(self, path: str) -> Any:
+        return self.execute("LOAD", [path])
+
+    def snapshot(self, path: str) -> Any:
+        return self.execute("SNAPSHOT", [path])
+
+    def profile(self, mode: str, seconds: float, path: str) -> Any:
+        return self.execute("PROFILE", [mode, str(seconds), path])
+
+    def profile_stop(self) -> Any:
+        return self.execute("PROFILE", ["stop"])
+
+    def timers(self, action: Optional[str] = None) -> Any:
+        return self.execute("TIMERS", [action] if action is not None else [])
+
+
+def decode_responses(
+    commands: List[Tuple[str, Union[dict, list]]],
+    responses: List[str],
+    broker: bool = False,
+    raise_on_error: bool = True,
+) -> List[Any]:
+    """Decodes the responses of a pipeline
+    :param commands: The commands of the pipeline
+    :param responses: The responses, in the order of the commands
+    :param broker: If True the responses are of a broker
+    :param raise_on_error: If True the first failed command raises its exception, otherwise the exception takes the
+    place of its result
+    :return: The list of the results
+    """
+    results = list()
+    error: Optional[CustomClientException] = None
+    for (command, _), response in zip(commands, responses):
+        try:
+            results.append(decode_response(command, response, broker))
+        except CustomClientException as e:
+            error = error or e
+            results.append(e)
+    if raise_on_error and error is not None:
+        raise error
+    return results
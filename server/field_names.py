@@ -0,0 +1,75 @@
+import sys
+
+from typing import Optional
+
+# Maximum number of interned field names. The field names come from the data of the clients and are never removed, so
+# the vocabulary is capped; the names past the cap are stored raw.
+MAX_FIELD_NAMES = 1 << 16
+
+# Prefix of a raw field name. An encoded ID is a single character, so a raw name is always at least 2 characters long.
+RAW_PREFIX = "\x00"
+
+
+class FieldNameDictionary:
+    """Server-side vocabulary of the nested field names. Every field name is interned once and the stored records
+    reference it by a small integer ID. The ID is encoded as a single character (chr(ID)) so the nested Tries keep
+    working on str tokens and a field name costs a single node instead of one node per character.
+
+    The dictionary never shrinks: a name stays interned after the records that use it are deleted. Once it holds
+    max_names names, the new names are not interned but stored raw, prefixed with RAW_PREFIX.
+    """
+
+    def __init__(self, max_names: int = MAX_FIELD_NAMES):
+        """
+        :param max_names: The maximum number of interned names, at most 0x110000 as every ID is a single character
+        """
+        self.ids = dict()
+        self.names = list()
+        self.max_names = min(max_names, sys.maxunicode + 1)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def intern(self, name: str) -> str:
+        """Returns the encoded ID of a field name, assigning a new one if the name is not known yet
+        :param name: The field name
+        :return: The encoded ID
+        """
+        code = self.ids.get(name)
+        if code is None:
+            if len(self.names) >= self.max_names:
+                return RAW_PREFIX + name
+            code = chr(len(self.names))
+            self.names.append(name)
+            self.ids[name] = code
+        return code
+
+    def lookup(self, name: str) -> Optional[str]:
+        """Returns the encoded ID of a field name without interning it
+        :param name: The field name
+        :return: The encoded ID, or None if the name is unknown and so not stored
+        """
+        code = self.ids.get(name)
+        if code is None and len(self.names) >= self.max_names:
+            # Stored raw, if stored at all
+            return RAW_PREFIX + name
+        return code
+
+    def decode(self, code: str) -> str:
+        """Returns the field name of an encoded ID
+        :param code: The encoded ID or the raw name
+        :return: The field name
+        """
+        if len(code) > 1:
+            return code[1:]
+        return self.names[ord(code)]
+
+    def memory_size(self) -> int:
+        """Approximate memory held by the dictionary itself
+        :return: The size in bytes
+        """
+        return (
+            sys.getsizeof(self.ids)
+            + sys.getsizeof(self.names)
+            + sum(sys.getsizeof(name) for name in self.names)
+        )
@@ -0,0 +1,192 @@
+import logging
+import multiprocessing as mp
+import os
+import re
+import time
+
+from functools import partial
+from typing import List, Tuple, Any, Optional, Iterator
+
+from server.trie import Trie, render_value
+from tools.general_tools import (
+    data_string_to_dict,
+    extract_routing_key,
+    shard_for_key,
+    CustomValidationException,
+)
+
+logger = logging.getLogger(__name__)
+
+# Number of data file lines that are parsed & inserted to the Trie together
+BATCH_SIZE = 5000
+
+# The server is multi-threaded, a forked process could inherit a lock that another thread holds (e.g. the lock of a
+# logging handler) and deadlock, so the parsing processes are spawned
+MP_CONTEXT = mp.get_context("spawn")
+
+# The quoted strings of a data file line, removed before its brackets are matched
+STRING_PATTERN = re.compile(r"'(?:[^'\\\n]|\\.)*'|\"(?:[^\"\\\n]|\\.)*\"")
+
+BRACKET_PATTERN = re.compile(r"[{}\[\]]")
+
+
+def single_pair(line: str) -> bool:
+    """Tells if a data file line surely holds a single pair, i.e. a key & a dictionary or list that ends the line,
+    e.g. "'person_1': {'age': 12}". Only the brackets outside the strings are matched, which is much cheaper than
+    parsing the line.
+    :param line: The data file line
+    :return: True if the line holds a single pair, False if it may hold more
+    """
+    outside = STRING_PATTERN.sub("", line)
+    depth = 0
+    for match in BRACKET_PATTERN.finditer(outside):
+        if depth == 0 and outside[: match.start()].strip() != ":":
+            return False
+        depth += 1 if match.group() in "{[" else -1
+        if depth == 0:
+            return not outside[match.end() :].strip(" \t\r\n;,")
+    return False
+
+
+def line_owner(line: str, shards: int) -> Optional[int]:
+    """Finds the shard of a data file line without parsing it. The key of the line is extracted with a regex, which
+    is only enough for the lines with a single pair, any other line may hold keys of all the shards.
+    :param line: The data file line
+    :param shards: The number of shards
+    :return: The index of the shard or None if the line has to be parsed by all of them
+    """
+    key = extract_routing_key(line)
+    if key is None or not single_pair(line):
+        return None
+    return shard_for_key(key, shards)
+
+
+def parse_lines(
+    lines: List[str], shard: Optional[Tuple[int, int]] = None
+) -> Tuple[List[Tuple[str, Any]], int]:
+    """Parses a batch of data file lines. Runs at the processes of the pool. If a shard is given, the lines of the
+    other shards are skipped and only the pairs of its own keys are kept, since a line may hold pairs of many shards.
+    :param lines: The lines to parse
+    :param shard: A tuple (<shard index>, <number of shards>) if only the keys of a shard should be kept
+    :return: A tuple that at 0 index is placed the list of the parsed (key, value) tuples & at 1 index the number of
+    rejected lines
+    """
+    items = list()
+    rejected = 0
+    for line in lines:
+        if shard is None:
+            owner = index = 0
+        else:
+            index, shards = shard
+            owner = line_owner(line, shards)
+            if owner is not None and owner != index:
+                continue
+        try:
+            pairs = data_string_to_dict(line).items()
+        except CustomValidationException:
+            # The lines that all the shards parse are reported as rejected by the 1st one
+            if (owner or 0) == index:
+                rejected += 1
+            continue
+        if owner is None:
+            pairs = [pair for pair in pairs if shard_for_key(pair[0], shards) == index]
+        items.extend(pairs)
+    return items, rejected
+
+
+def read_batches(path: str) -> Iterator[List[str]]:
+    """Reads a data file in batches of lines
+    :param path: The path of the data file
+    :return: An iterator of batches of lines
+    """
+    batch = list()
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            batch.append(line)
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = list()
+    if batch:
+        yield batch
+
+
+def load_file(
+    trie: Trie,
+    path: str,
+    shard: Optional[Tuple[int, int]] = None,
+    processes: Optional[int] = None,
+) -> dict:
+    """Bulk loads a data file of the dataset.txt format into a Trie. The batches of lines are parsed in parallel
+    by a pool of processes and each parsed batch is inserted with Trie.bulk_insert.
+    :param trie: The Trie to load the data to
+    :param path: The path of the data file
+    :param shard: A tuple (<shard index>, <number of shards>) if only the keys of a shard should be loaded
+    :param processes: The number of parsing processes, by default the available cores (divided to the shards)
+    :return: A dictionary that reports the loaded records, the rejected lines & the loading rate
+    """
+    if processes is None:
+        shards = shard[1] if shard is not None else 1
+        processes = max(1, (os.cpu_count() or 1) // shards)
+
+    start = time.perf_counter()
+    loaded = 0
+    rejected = 0
+    try:
+        batches = read_batches(path)
+        parse = partial(parse_lines, shard=shard)
+        if processes > 1:
+            with MP_CONTEXT.Pool(processes=processes) as pool:
+                for items, rejected_ in pool.imap(parse, batches):
+                    trie.bulk_insert(items)
+                    loaded += len(items)
+                    rejected += rejected_
+        else:
+            for items, rejected_ in map(parse, batches):
+                trie.bulk_insert(items)
+                loaded += len(items)
+                rejected += rejected_
+    except OSError as e:
+        raise CustomValidationException(f"Cannot read data file {path}\n{e}")
+
+    seconds = time.perf_counter() - start
+    if rejected:
+        logger.warning(f"{rejected} lines of {path} were rejected")
+    return {
+        "loaded": loaded,
+        "rejected": rejected,
+        "seconds": round(seconds, 3),
+        "records_per_second": round(loaded / seconds, 1) if seconds else 0.0,
+    }
+
+
+def save_snapshot(trie: Trie, path: str) -> dict:
+    """Writes the key/value pairs of a Trie to a data file of the dataset.txt format, which can be loaded back with
+    --preload or the LOAD command. The file is written under a temporary name and renamed when complete, so a
+    failed snapshot never replaces a previous one.
+    :param trie: The Trie to save, usually a snapshot so the writes can continue meanwhile
+    :param path: The path of the data file
+    :return: A dictionary that reports the saved records & the saving rate
+    """
+    start = time.perf_counter()
+    saved = 0
+    temporary = f"{path}.tmp"
+    try:
+        with open(temporary, "w") as file:
+            for key, value in trie.items():
+                # The pairs without the enclosing curly brackets: 'key': {'key1': 'value'}
+                file.write(
+                    f"{str({key: render_value(value, trie.field_names)})[1:-1]}\n"
+                )
+                saved += 1
+        os.replace(temporary, path)
+    except OSError as e:
+        raise CustomValidationException(f"Cannot write snapshot {path}\n{e}")
+
+    seconds = time.perf_counter() - start
+    return {
+        "saved": saved,
+        "seconds": round(seconds, 3),
+        "records_per_second": round(saved / seconds, 1) if seconds else 0.0,
+    }
@@ -0,0 +1,253 @@
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading as td
+import time
+import tracemalloc
+
+from collections import Counter
+from typing import Any, Callable, List, Optional
+
+from tools.general_tools import CustomValidationException
+
+logger = logging.getLogger(__name__)
+
+# The stages of a command at the server
+STAGES = ["read", "parse", "execute", "render", "write"]
+
+# Seconds between two samples of the sampling profiler
+SAMPLING_INTERVAL = 0.005
+
+# Number of frames that tracemalloc keeps for every allocation
+TRACEMALLOC_FRAMES = 25
+
+# Number of lines of the tracemalloc summary
+TRACEMALLOC_TOP = 50
+
+
+class StageTimers:
+    """Accumulates the time the commands spend at each stage. Disabled by default, so the only cost is a check of
+    the enabled flag per command.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = td.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counts = dict.fromkeys(STAGES, 0)
+            self.totals = dict.fromkeys(STAGES, 0.0)
+
+    def lap(self, stage: str, start: float) -> float:
+        """Adds the time from start until now to a stage
+        :param stage: The stage
+        :param start: The perf_counter() value when the stage started
+        :return: The perf_counter() value now, i.e. the start of the next stage
+        """
+        now = time.perf_counter()
+        with self.lock:
+            self.counts[stage] += 1
+            self.totals[stage] += now - start
+        return now
+
+    def report(self) -> dict:
+        """The totals are flat counters, so the reports of the shards can be summed
+        :return: A dictionary with the number of commands & the seconds spent at each stage
+        """
+        with self.lock:
+            report = dict()
+            for stage in STAGES:
+                report[f"{stage}_count"] = self.counts[stage]
+                report[f"{stage}_seconds"] = round(self.totals[stage], 6)
+            return report
+
+
+class CpuProfile:
+    """cProfile of the commands. cProfile only sees the thread that enabled it, so every connection thread profiles
+    its commands with its own profiler and the profilers are merged to a single pstats file when stopped.
+    """
+
+    def __init__(self, path: str):
+        self.path = f"{path}.pstats"
+        self.active = True
+        self.profiles = list()
+        self.local = td.local()
+        self.in_flight = 0
+        self.condition = td.Condition()
+
+    def start(self) -> None:
+        pass
+
+    def runcall(self, function: Callable, *args: Any) -> Any:
+        """Calls a function under the profiler of the current thread
+        :param function: The function
+        :param args: The arguments of the function
+        :return: The result of the function
+        """
+        with self.condition:
+            if not self.active:
+                return function(*args)
+            self.in_flight += 1
+        try:
+            profile = getattr(self.local, "profile", None)
+            if profile is None:
+                profile = self.local.profile = cProfile.Profile()
+                with self.condition:
+                    self.profiles.append(profile)
+            self.local.running = True
+            return profile.runcall(function, *args)
+        finally:
+            self.local.running = False
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def stop(self) -> List[str]:
+        # The command that stops the profiling may run under it, then its own profiler is disabled when it is read
+        own = 1 if getattr(self.local, "running", False) else 0
+        with self.condition:
+            self.active = False
+            # The profilers of the other threads can't be read while they are enabled
+            self.condition.wait_for(lambda: self.in_flight == own)
+        if not self.profiles:
+            self.profiles.append(cProfile.Profile())
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(self.path)
+        return [self.path]
+
+
+class SamplingProfile:
+    """Samples the stacks of all the threads at a fixed interval, without instrumenting the code. The samples are
+    written as collapsed stacks, one "frame;frame;frame count" line per distinct stack, the input format of the
+    flamegraph tools. Threads that wait for I/O are sampled too.
+    """
+
+    def __init__(self, path: str, interval: float = SAMPLING_INTERVAL):
+        self.path = f"{path}.collapsed"
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = td.Event()
+        self.thread = td.Thread(name="sampling-profiler", target=self.run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def run(self) -> None:
+        own = td.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = list()
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self) -> List[str]:
+        self.stopped.set()
+        self.thread.join()
+        with open(self.path, "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+        return [self.path]
+
+
+class MemoryProfile:
+    """tracemalloc tracking of the allocations. When stopped the allocations that are still alive are dumped as a
+    tracemalloc snapshot, which can be loaded with tracemalloc.Snapshot.load, and as a summary of the top lines.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def start(self) -> None:
+        if tracemalloc.is_tracing():
+            raise CustomValidationException("tracemalloc is already tracing")
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def stop(self) -> List[str]:
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        snapshot.dump(f"{self.path}.tracemalloc")
+        with open(f"{self.path}.txt", "w") as file:
+            for statistic in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+                file.write(f"{statistic}\n")
+        return [f"{self.path}.tracemalloc", f"{self.path}.txt"]
+
+
+PROFILES = {"cpu": CpuProfile, "sampling": SamplingProfile, "memory": MemoryProfile}
+
+
+class Profiler:
+    """Starts & stops the profiling sessions of a live server. Every session runs for a time window, or until it is
+    stopped, and then dumps its results to files.
+    """
+
+    def __init__(self):
+        self.lock = td.Lock()
+        self.sessions = dict()
+        # The running cProfile session, checked by every command
+        self.cpu: Optional[CpuProfile] = None
+
+    def start(self, mode: str, seconds: float, path: str) -> None:
+        """Starts a profiling session
+        :param mode: 'cpu' for cProfile, 'sampling' for the sampling profiler or 'memory' for tracemalloc
+        :param seconds: The time window, the session stops by itself afterwards
+        :param path: The path of the output files without the extension
+        :return: None
+        """
+        if mode not in PROFILES:
+            raise CustomValidationException(
+                f"Available profiling modes are: {', '.join(PROFILES)}"
+            )
+        # Also rejects nan & inf, the timer of the session couldn't stop it
+        if not 0 < seconds <= td.TIMEOUT_MAX:
+            raise CustomValidationException(
+                "The time window should be a positive, finite number of seconds"
+            )
+        with self.lock:
+            if mode in self.sessions:
+                raise CustomValidationException(f"{mode} profiling is already running")
+            session = PROFILES[mode](path)
+            session.start()
+            timer = td.Timer(seconds, self.stop, args=(mode,))
+            timer.daemon = True
+            self.sessions[mode] = (session, timer)
+            if mode == "cpu":
+                self.cpu = session
+        timer.start()
+        logger.info(f"Started {mode} profiling for {seconds} seconds")
+
+    def stop(self, mode: Optional[str] = None) -> List[str]:
+        """Stops profiling sessions and dumps their results
+        :param mode: The mode of the session to stop, all the sessions if None
+        :return: The paths of the written files
+        """
+        with self.lock:
+            modes = [mode] if mode is not None else list(self.sessions)
+            stopped = [
+                self.sessions.pop(mode_) for mode_ in modes if mode_ in self.sessions
+            ]
+            if "cpu" in modes:
+                self.cpu = None
+
+        files = list()
+        for session, timer in stopped:
+            timer.cancel()
+            try:
+                files.extend(session.stop())
+            except OSError as e:
+                logger.error(f"Cannot write the profiling results\n{e}")
+        if files:
+            logger.info(f"Profiling results written to {files}")
+        return files
@@ -1,36 +1,86 @@
 import logging
-from socketserver import StreamRequestHandler, TCPServer
-from typing import Tuple, Any
+import threading as td
+import time
 
+from socketserver import ThreadingMixIn, TCPServer
+from typing import Tuple, Any, Optional, List
+
+from server.field_names import FieldNameDictionary
+from server.loader import load_file, save_snapshot
+from server.profiler import Profiler, StageTimers
 from server.trie import Trie
 from tools.general_tools import (
     validate_ip_port,
     parse_command_for_server,
+    resolve_data_path,
+    parse_time_window,
+    shard_for_key,
     CustomValidationException,
+    PipelinedRequestHandler,
 )
 
 logger = logging.getLogger(__name__)
 
 
-class RequestHandler(StreamRequestHandler):
+class RequestHandler(PipelinedRequestHandler):
     def handle(self):
         while True:
             if not self.rfile.peek():
                 break
-            payload = self.rfile.readline().strip()
-            result = self.server.process_command(
-                self.client_address, str(payload, "utf-8")
-            )
-            self.wfile.write(bytes(result, "utf-8"))
+            timers = self.server.timers if self.server.timers.enabled else None
+            start = time.perf_counter() if timers is not None else 0.0
+            payload = str(self.rfile.readline().strip(), "utf-8")
+            if timers is not None:
+                timers.lap("read", start)
+            cpu = self.server.profiler.cpu
+            if cpu is None:
+                result = self.server.process_command(self.client_address, payload)
+            else:
+                result = cpu.runcall(
+                    self.server.process_command, self.client_address, payload
+                )
+            if timers is not None:
+                start = time.perf_counter()
+            # Responses are newline terminated so the clients can keep the connection open
+            self.wfile.write(bytes(result + "\n", "utf-8"))
+            if timers is not None:
+                timers.lap("write", start)
 
 
-class KeyValueServer(TCPServer):
-    def __init__(self, server_address: Tuple[str, int]):
+class KeyValueServer(ThreadingMixIn, TCPServer):
+    # Brokers keep their connections open, so every connection is served by its own thread
+    daemon_threads = True
+
+    def __init__(
+        self,
+        server_address: Tuple[str, int],
+        shard: Optional[Tuple[int, int]] = None,
+        data_dir: str = ".",
+        copy_on_write: bool = True,
+    ):
+        """
+        :param server_address: The IP address & port to listen to
+        :param shard: A tuple (<shard index>, <number of shards>) when the server is a worker of a sharded server.
+        The server refuses the keys of the other shards.
+        :param data_dir: The directory of the files that LOAD reads and SNAPSHOT & PROFILE write, their paths are
+        relative to it
+        :param copy_on_write: If True the commands read a point-in-time view of the Trie, otherwise the Trie is
+        modified in place, which doubles the write throughput but a command may see the writes of others midway
+        """
         validate_ip_port(*server_address)
         super().__init__(
             server_address=server_address, RequestHandlerClass=RequestHandler
         )
-        self.trie_index = Trie()
+        self.trie_index = Trie(
+            field_names=FieldNameDictionary(), copy_on_write=copy_on_write
+        )
+        # Held while a background snapshot is written
+        self.snapshot_lock = td.Lock()
+        self.shard = shard
+        self.data_dir = data_dir
+        # Profiling & per-stage timers, switched on at runtime by the PROFILE & TIMERS commands
+        self.profiler = Profiler()
+        self.timers = StageTimers()
 
     def serve(self):
         try:
@@ -39,29 +89,174 @@ class KeyValueServer(TCPServer):
             pass
         self.server_close()
 
+    def preload(self, path: str) -> str:
+        """Bulk loads a data file before serving
+        :param path: The path of the data file, relative to the data directory
+        :return: The response of the LOAD command
+        """
+        return self.process_command("preload", f"LOAD {[path]}")
+
+    def owns_keys(self, command: str, data: Any) -> bool:
+        """Checks that the top level keys of a command belong to the shard of the server
+        :param command: The parsed command
+        :param data: The parsed data
+        :return: Boolean
+        """
+        if self.shard is None:
+            return True
+        index, shards = self.shard
+        if command == "PUT":
+            keys = data.keys()
+        elif command in ["GET", "QUERY", "DELETE"]:
+            keys = data[:1]
+        else:
+            return True
+        return all(shard_for_key(key, shards) == index for key in keys)
+
+    def start_snapshot(self, path: str) -> None:
+        """Captures a point-in-time view of the Trie and writes it to a data file in the background, while the
+        server keeps serving writes. A worker of a sharded server writes its shard to <path>.<shard index>.
+        :param path: The path of the data file, relative to the data directory
+        :return: None
+        """
+        path = resolve_data_path(self.data_dir, path)
+        if self.shard is not None:
+            path = f"{path}.{self.shard[0]}"
+        if not self.snapshot_lock.acquire(blocking=False):
+            raise CustomValidationException("A snapshot is already running")
+        snapshot = self.trie_index.snapshot()
+        td.Thread(
+            name="snapshot-writer",
+            target=self.write_snapshot,
+            args=(snapshot, path),
+            daemon=True,
+        ).start()
+
+    def write_snapshot(self, snapshot: Trie, path: str) -> None:
+        """Thread that writes a snapshot and releases the snapshot lock
+        :param snapshot: The captured view of the Trie
+        :param path: The path of the data file
+        :return: None
+        """
+        try:
+            logger.info(f"Snapshot {path}: {save_snapshot(snapshot, path)}")
+        except CustomValidationException as e:
+            logger.error(e)
+        finally:
+            self.snapshot_lock.release()
+
+    def profile(self, data: List[str]) -> Any:
+        """Executes a PROFILE command: ['cpu'|'sampling'|'memory', <seconds>, <path>] starts a profiling session,
+        ['stop'] stops all the sessions. A worker of a sharded server writes to <path>.<shard index>.
+        :param data: The parsed data
+        :return: "OK" or the list of the written files
+        """
+        if data == ["stop"]:
+            return self.profiler.stop()
+        if len(data) != 3:
+            raise CustomValidationException("Malformed data")
+        mode, seconds, path = data
+        seconds = parse_time_window(seconds)
+        path = resolve_data_path(self.data_dir, path)
+        if self.shard is not None:
+            path = f"{path}.{self.shard[0]}"
+        self.profiler.start(mode, seconds, path)
+        return "OK"
+
+    def switch_timers(self, data: List[str]) -> Any:
+        """Executes a TIMERS command: ['on'] & ['off'] switch the per-stage timers, ['reset'] clears them and []
+        reports them
+        :param data: The parsed data
+        :return: "OK" or the report of the timers
+        """
+        if not data:
+            return self.timers.report()
+        if data == ["on"]:
+            self.timers.enabled = True
+        elif data == ["off"]:
+            self.timers.enabled = False
+        elif data == ["reset"]:
+            self.timers.reset()
+        else:
+            raise CustomValidationException("Malformed data")
+        return "OK"
+
     def process_command(self, client_address: Any, payload: str) -> str:
+        timers = self.timers if self.timers.enabled else None
+        start = time.perf_counter() if timers is not None else 0.0
         try:
             command, data = parse_command_for_server(payload)
+            if timers is not None:
+                start = timers.lap("parse", start)
             logger.info(
                 f"Server:{self.server_address} received from client {client_address}: {command} {data}"
             )
+            result = self.execute_command(command, data)
+            if timers is not None:
+                start = timers.lap("execute", start)
             if command in ["GET", "QUERY"]:
-                # Maybe it is redundant but just check in any case...
-                if command == "GET" and len(data) > 1:
-                    raise CustomValidationException("Malformed data")
-                result = self.trie_index.search_by_keys(data)
-                return str(result) if result else "NOT FOUND"
-            elif command == "PUT":
-                self.trie_index.insert_dict(data)
-                return "OK"
-            elif command == "DELETE":
-                # Maybe it is redundant but just check in any case...
-                if len(data) > 1:
-                    raise CustomValidationException("Malformed data")
-                result = self.trie_index.delete(data[0])
-                return "OK" if result else "NOT FOUND"
+                # repr() keeps the strings quoted, so the clients decode the values exactly
+                response = repr(result) if result is not None else "NOT FOUND"
+            elif command == "SCAN":
+                response = str(result) if result else "NOT FOUND"
             else:
-                return "ERROR"
+                response = str(result)
+            if timers is not None:
+                timers.lap("render", start)
+            return response
         except CustomValidationException as e:
             logger.error(e)
             return "ERROR"
+        except Exception as e:
+            # Any other failure is answered too, so the connection & the commands pipelined behind it survive
+            logger.exception(f"Command failed: {type(e).__name__}")
+            return "ERROR"
+
+    def execute_command(self, command: str, data: Any) -> Any:
+        """Executes a parsed command
+        :param command: The parsed command
+        :param data: The parsed data
+        :return: The result, the found value for GET, QUERY & SCAN or the response for the rest
+        """
+        if not self.owns_keys(command, data):
+            return "WRONG SHARD"
+        if command in ["GET", "QUERY"]:
+            # Maybe it is redundant but just check in any case...
+            if command == "GET" and len(data) > 1:
+                raise CustomValidationException("Malformed data")
+            return self.trie_index.search_by_keys(data)
+        elif command == "PUT":
+            self.trie_index.insert_dict(data)
+            return "OK"
+        elif command == "DELETE":
+            # Maybe it is redundant but just check in any case...
+            if len(data) > 1:
+                raise CustomValidationException("Malformed data")
+            result = self.trie_index.delete(data[0])
+            return "OK" if result else "NOT FOUND"
+        elif command == "STATS":
+            return self.trie_index.stats()
+        elif command == "LOAD":
+            if len(data) != 1:
+                raise CustomValidationException("Malformed data")
+            return load_file(
+                self.trie_index,
+                resolve_data_path(self.data_dir, data[0]),
+                shard=self.shard,
+            )
+        elif command == "SNAPSHOT":
+            if len(data) != 1:
+                raise CustomValidationException("Malformed data")
+            self.start_snapshot(data[0])
+            return "OK"
+        elif command == "PROFILE":
+            return self.profile(data)
+        elif command == "TIMERS":
+            return self.switch_timers(data)
+        elif command == "SCAN":
+            prefix = data[0] if data else ""
+            if type(prefix) is not str:
+                raise CustomValidationException("Malformed data")
+            return self.trie_index.scan(prefix)
+        else:
+            return "ERROR"
@@ -0,0 +1,333 @@
+import ast
+import logging
+import multiprocessing as mp
+import socket
+import threading as td
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingTCPServer
+from typing import Callable, Tuple, List, Optional
+
+from server.server import KeyValueServer
+from tools.general_tools import (
+    validate_ip_port,
+    parse_command_for_server,
+    shard_for_key,
+    extract_routing_key,
+    merge_scan_results,
+    merge_stats_results,
+    CustomValidationException,
+    CustomBrokerConnectionException,
+    PipelinedRequestHandler,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(
+    server_address: Tuple[str, int],
+    shard: Tuple[int, int],
+    data_dir: str,
+    copy_on_write: bool,
+) -> None:
+    """Entry point of a worker process. Serves a shard of the keyspace on a local address.
+    :param server_address: The local address of the worker
+    :param shard: A tuple (<shard index>, <number of shards>)
+    :param data_dir: The data directory of the server
+    :param copy_on_write: If True the Trie of the worker is copy-on-write
+    :return: None
+    """
+    server = KeyValueServer(
+        server_address=server_address,
+        shard=shard,
+        data_dir=data_dir,
+        copy_on_write=copy_on_write,
+    )
+    server.serve()
+
+
+def find_free_port(ip_address: str) -> int:
+    """Asks the OS for a free port
+    :param ip_address: The IP address to bind to
+    :return: The port
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((ip_address, 0))
+        return sock.getsockname()[1]
+
+
+class WorkerConnection:
+    """Persistent connection of the dispatcher to a worker. The workers execute one command at a time, so the
+    requests of all the clients are serialized over a single connection. A broken connection is dropped and opened
+    again by the next request, as long as the worker process is alive.
+    """
+
+    def __init__(
+        self,
+        server_address: Tuple[str, int],
+        process: mp.Process,
+        timeout: float = 10.0,
+    ):
+        """
+        :param server_address: The local address of the worker
+        :param process: The worker process
+        :param timeout: Seconds to wait for the worker to start up
+        """
+        self.server_address = server_address
+        self.process = process
+        self.lock = td.Lock()
+        self.sock = None
+        self.rfile = None
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.__connect()
+                break
+            except ConnectionRefusedError as e:
+                # The worker process is still starting up
+                if time.monotonic() > deadline:
+                    raise CustomBrokerConnectionException(
+                        f"Worker {server_address} not reachable.\n{e}"
+                    )
+                time.sleep(0.05)
+
+    def __connect(self) -> None:
+        self.sock = socket.create_connection(self.server_address)
+        self.rfile = self.sock.makefile("rb")
+
+    def __drop(self) -> None:
+        """Closes a broken connection, so the next request opens a new one. Called with the lock held.
+        :return: None
+        """
+        try:
+            self.rfile.close()
+            self.sock.close()
+        except OSError:
+            pass
+        self.sock = None
+        self.rfile = None
+
+    def request(self, payload: str) -> str:
+        """Sends a command to the worker and waits for the response
+        :param payload: The socket level command
+        :return: The response of the worker
+        """
+        with self.lock:
+            if not self.process.is_alive():
+                logger.error(
+                    f"Worker {self.server_address} exited with code {self.process.exitcode}"
+                )
+                return "ERROR"
+            try:
+                if self.sock is None:
+                    self.__connect()
+                self.sock.sendall(bytes(payload + "\n", "utf-8"))
+                line = self.rfile.readline()
+                if not line.endswith(b"\n"):
+                    raise ConnectionError("Connection closed by the worker")
+                return str(line, "utf-8").strip()
+            except OSError as e:
+                logger.error(f"Worker {self.server_address} not reachable\n{e}")
+                if self.sock is not None:
+                    self.__drop()
+                return "ERROR"
+
+    def close(self) -> None:
+        with self.lock:
+            if self.sock is not None:
+                self.__drop()
+
+
+class DispatcherRequestHandler(PipelinedRequestHandler):
+    def handle(self):
+        while True:
+            if not self.rfile.peek():
+                break
+            payload = self.rfile.readline().strip()
+            result = self.server.dispatch(str(payload, "utf-8"))
+            self.wfile.write(bytes(result + "\n", "utf-8"))
+
+
+class ShardedKeyValueServer(ThreadingTCPServer):
+    """Listens to a single address and forwards the commands to N worker processes, each one owning a hash
+    partitioned shard of the keyspace. This way the parsing & the Trie operations of the shards run in parallel
+    on different cores.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        server_address: Tuple[str, int],
+        workers: int,
+        data_dir: str = ".",
+        copy_on_write: bool = True,
+    ):
+        """
+        :param server_address: The IP address & port to listen to
+        :param workers: The number of worker processes
+        :param data_dir: The data directory of the workers, see KeyValueServer
+        :param copy_on_write: If True the Tries of the workers are copy-on-write, see KeyValueServer
+        """
+        validate_ip_port(*server_address)
+        if workers < 2:
+            raise CustomValidationException("A sharded server needs at least 2 workers")
+        # Start the workers before binding, so they don't inherit the listening socket
+        self.processes = list()
+        worker_addresses = list()
+        for index in range(workers):
+            worker_address = ("127.0.0.1", find_free_port("127.0.0.1"))
+            process = mp.Process(
+                name=f"kv-server-worker-{index}",
+                target=run_worker,
+                args=(worker_address, (index, workers), data_dir, copy_on_write),
+            )
+            process.start()
+            self.processes.append(process)
+            worker_addresses.append(worker_address)
+
+        try:
+            super().__init__(
+                server_address=server_address,
+                RequestHandlerClass=DispatcherRequestHandler,
+            )
+            self.workers = [
+                WorkerConnection(address, process)
+                for address, process in zip(worker_addresses, self.processes)
+            ]
+        except (OSError, CustomBrokerConnectionException):
+            for process in self.processes:
+                process.terminate()
+            raise
+        # Used to fan out the cross-shard commands
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        logger.info(
+            f"Server:{self.server_address} started {workers} workers at {worker_addresses}"
+        )
+
+    def serve(self):
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            self.pool.shutdown(wait=False)
+            for worker in self.workers:
+                worker.close()
+            for process in self.processes:
+                process.terminate()
+                process.join()
+
+    def preload(self, path: str) -> str:
+        """Bulk loads a data file to the workers before serving
+        :param path: The path of the data file, relative to the data directory
+        :return: The response of the LOAD command
+        """
+        return self.dispatch(f"LOAD {[path]}")
+
+    def broadcast(self, payload: str) -> List[str]:
+        """Sends a command to all the workers in parallel
+        :param payload: The socket level command
+        :return: The responses of the workers
+        """
+        return list(self.pool.map(lambda worker: worker.request(payload), self.workers))
+
+    def broadcast_all(
+        self, payload: str, valid: Callable[[str], bool]
+    ) -> Optional[List[str]]:
+        """Sends a command to all the workers in parallel, for the commands whose responses are merged. A merged
+        response without the response of a shard would look complete, so it is answered only if all the shards
+        succeed.
+        :param payload: The socket level command
+        :param valid: Function that tells if a response of a worker is a result
+        :return: The responses of the workers or None if any of them failed
+        """
+        results = self.broadcast(payload)
+        failed = [index for index, result in enumerate(results) if not valid(result)]
+        if not failed:
+            return results
+        # The commands that all the shards reject are malformed, the workers have logged them
+        if len(failed) < len(results):
+            logger.error(f"Shards {failed} failed to execute {payload[:100]}")
+        return None
+
+    def split_put(self, payload: str) -> str:
+        """Splits a PUT command that contains keys of many shards to one PUT command per shard. The shards are not
+        written atomically: if a shard fails the command is answered with ERROR, but the keys of the other shards
+        are stored. The failed keys are logged. PUT overwrites the keys, so the command can be safely sent again.
+        :param payload: The socket level command
+        :return: The merged response
+        """
+        try:
+            command, data = parse_command_for_server(payload)
+        except CustomValidationException as e:
+            logger.error(e)
+            return "ERROR"
+        parts = dict()
+        for key, value in data.items():
+            parts.setdefault(shard_for_key(key, len(self.workers)), {})[key] = value
+        failed = list()
+        for index, part in parts.items():
+            if self.workers[index].request(f"{command} {part}") != "OK":
+                failed.extend(part)
+        if failed:
+            logger.error(f"PUT partially applied, failed keys: {failed}")
+            return "ERROR"
+        return "OK"
+
+    def dispatch(self, payload: str) -> str:
+        """Routes a socket level command to the worker that owns its key, or to all the workers for the
+        cross-shard commands, and returns the merged response.
+        :param payload: The socket level command
+        :return: The response
+        """
+        command = payload.split(" ", 1)[0]
+        if command in ["STATS", "LOAD"]:
+            results = self.broadcast_all(payload, lambda result: result.startswith("{"))
+            if results is None:
+                return "ERROR"
+            result = merge_stats_results(results)
+            if command == "LOAD":
+                # Each worker loads its own shard of the file
+                stats = ast.literal_eval(result)
+                if stats["seconds"]:
+                    stats["records_per_second"] = round(
+                        stats["loaded"] / stats["seconds"], 1
+                    )
+                result = str(stats)
+            return result
+        elif command == "SCAN":
+            results = self.broadcast_all(
+                payload,
+                lambda result: result.startswith("{") or result == "NOT FOUND",
+            )
+            return merge_scan_results(results) if results is not None else "ERROR"
+        elif command in ["SNAPSHOT", "PROFILE", "TIMERS"]:
+            # Each worker writes its own files to <path>.<shard index>
+            results = self.broadcast_all(
+                payload, lambda result: result == "OK" or result.startswith(("[", "{"))
+            )
+            if results is None:
+                return "ERROR"
+            elif all(result == "OK" for result in results):
+                return "OK"
+            elif all(result.startswith("[") for result in results):
+                # The files written by PROFILE stop
+                return str(
+                    [path for result in results for path in ast.literal_eval(result)]
+                )
+            elif all(result.startswith("{") for result in results):
+                # The reports of the timers
+                return merge_stats_results(results)
+            return "ERROR"
+
+        key = extract_routing_key(payload)
+        # Malformed commands are rejected by any worker
+        index = shard_for_key(key, len(self.workers)) if key is not None else 0
+        result = self.workers[index].request(payload)
+        if result == "WRONG SHARD":
+            # Either a PUT with keys of many shards or a key that could not be extracted
+            return self.split_put(payload) if command == "PUT" else "ERROR"
+        return result
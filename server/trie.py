@@ -1,4 +1,16 @@
-from typing import List, Any, Union
+import gc
+import sys
+import threading as td
+
+from contextlib import nullcontext
+from operator import itemgetter
+from typing import List, Any, Union, Optional, Iterator, Tuple
+
+from server.field_names import FieldNameDictionary
+
+# Nested dictionaries with up to this number of keys are stored as a CompactMap. Bigger ones are promoted to
+# a sub-Trie. Zero disables the compact representation.
+COMPACT_MAP_THRESHOLD = 8
 
 
 class TrieNode:
@@ -7,10 +19,80 @@ class TrieNode:
         self.is_terminal = False
         self.value = None  # Instantiates only when the node is terminal
 
+    def copy(self) -> "TrieNode":
+        """Shallow copy of the node, the children are shared with the original"""
+        node = TrieNode()
+        node.children = self.children.copy()
+        node.is_terminal = self.is_terminal
+        node.value = self.value
+        return node
+
+
+# Approximate memory of an empty node, used to estimate the savings of the interned field names
+_node = TrieNode()
+TRIE_NODE_SIZE = (
+    sys.getsizeof(_node) + sys.getsizeof(_node.__dict__) + sys.getsizeof(_node.children)
+)
+del _node
+
+
+class CompactMap:
+    """Flat, tuple-backed map used to store small nested dictionaries. A handful of fields are searched faster
+    with a linear scan than by walking a sub-Trie of per-character nodes and take a fraction of the memory.
+    """
+
+    __slots__ = ("keys", "values")
+
+    def __init__(self, keys: tuple, values: tuple):
+        self.keys = keys
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(self, key: str) -> Any:
+        """CompactMap search operation.
+        :param key: The key to search
+        :return: The value or None if not found
+        """
+        for key_, value in zip(self.keys, self.values):
+            if key_ == key:
+                return value
+        return None
+
+    def to_dict(self, field_names: Optional[FieldNameDictionary] = None) -> dict:
+        """Renders the map, and all the nested maps/tries, back to a dictionary
+        :param field_names: The dictionary to decode the interned keys with, if any
+        :return: The dictionary
+        """
+        return {
+            (field_names.decode(key) if field_names is not None else key): render_value(
+                value, field_names
+            )
+            for key, value in zip(self.keys, self.values)
+        }
+
 
 class Trie:
-    def __init__(self):
+    def __init__(
+        self,
+        compact_threshold: int = COMPACT_MAP_THRESHOLD,
+        field_names: Optional[FieldNameDictionary] = None,
+        copy_on_write: bool = False,
+    ):
+        """
+        :param compact_threshold: Nested dictionaries up to this number of keys are stored as CompactMaps
+        :param field_names: If given, the nested field names are interned to it. Only the top level Trie holds the
+        dictionary, the nested maps/tries store the encoded IDs.
+        :param copy_on_write: If True the published nodes are never modified. The writers copy the path from the root
+        to the nodes they change and publish the new root at once, so a reader that captured a root sees the Trie as
+        it was at that moment, without blocking the writers or being blocked by them. The writers are serialized.
+        """
         self.root = TrieNode()
+        self.compact_threshold = compact_threshold
+        self.field_names = field_names
+        self.copy_on_write = copy_on_write
+        self.write_lock = td.Lock() if copy_on_write else None
 
     def insert(self, key: str, value: Any) -> None:
         """Trie insert operation.
@@ -18,6 +100,15 @@ class Trie:
         :param value: The value to store
         :return: None
         """
+        if self.copy_on_write:
+            with self.write_lock:
+                root = self.root.copy()
+                node = self.copy_path(root, key, {id(root)})
+                node.is_terminal = True
+                node.value = value
+                self.root = root
+            return
+
         tokens = [ch for ch in key]
         node = self.root
         for token in tokens:
@@ -28,11 +119,47 @@ class Trie:
         node.is_terminal = True
         node.value = value
 
+    @staticmethod
+    def copy_path(node: TrieNode, key: str, fresh: set) -> TrieNode:
+        """Walks down from a node that is not published yet and copies every published node of the path of the key,
+        so the path can be modified without affecting the readers.
+        :param node: The unpublished node to start from, usually the copy of the root
+        :param key: The key
+        :param fresh: The ids of the unpublished nodes, which are modified in place. The copies are added to it.
+        :return: The unpublished node of the key
+        """
+        for token in key:
+            child = node.children.get(token)
+            if child is None:
+                child = TrieNode()
+            elif id(child) in fresh:
+                node = child
+                continue
+            else:
+                child = child.copy()
+            node.children[token] = child
+            fresh.add(id(child))
+            node = child
+        return node
+
     def delete(self, key: str) -> bool:
         """Trie delete operation.
         :param key: The key to delete
         :return: Boolean
         """
+        if self.copy_on_write:
+            with self.write_lock:
+                # The nodes of the prefixes of other keys exist too, only a terminal node holds a key
+                node = self.find_node(self.root, key)
+                if node is None or not node.is_terminal:
+                    return False
+                root = self.root.copy()
+                node = self.copy_path(root, key, {id(root)})
+                node.is_terminal = False
+                node.value = None
+                self.root = root
+            return True
+
         tokens = [ch for ch in key]
         node = self.root
         for token in tokens:
@@ -41,7 +168,7 @@ class Trie:
                 return False
             node = node.children.get(token)
 
-        if not node:
+        if not node or not node.is_terminal:
             # Not found
             return False
         else:
@@ -64,54 +191,291 @@ class Trie:
 
         return node.value if node and node.is_terminal else None
 
-    def dfs(self, node: TrieNode, prefix: str, items_dict: dict) -> None:
+    @staticmethod
+    def find_node(node: TrieNode, key: str) -> Optional[TrieNode]:
+        """Walks down from a node to the node of the key
+        :param node: The node to start from
+        :param key: The key
+        :return: The node or None if not found
+        """
+        for token in key:
+            node = node.children.get(token)
+            if node is None:
+                return None
+        return node
+
+    def snapshot(self) -> "Trie":
+        """Point-in-time view of the Trie. With copy_on_write it shares the current root, as the published nodes are
+        never modified, so it costs nothing. Otherwise the nodes are copied, the stored values are never modified in
+        place by the Trie so they are shared.
+        :return: A Trie that is not affected by the later writes
+        """
+        snapshot_ = Trie(
+            compact_threshold=self.compact_threshold,
+            field_names=self.field_names,
+            copy_on_write=self.copy_on_write,
+        )
+        if self.copy_on_write:
+            snapshot_.root = self.root
+            return snapshot_
+        snapshot_.root = self.root.copy()
+        stack = [snapshot_.root]
+        while stack:
+            node = stack.pop()
+            for token, child in node.children.items():
+                child = child.copy()
+                node.children[token] = child
+                stack.append(child)
+        return snapshot_
+
+    def dfs(
+        self,
+        node: TrieNode,
+        prefix: str,
+        items_dict: dict,
+        field_names: Optional[FieldNameDictionary] = None,
+    ) -> None:
         """Depth First Search recursive method that returns a dict of all the keys/values given a starting node
         :param node: A node to start
         :param prefix: The prefix that is built upon the recursion
         :param items_dict: The list that contains key value pairs passed as param to built through the recursion
+        :param field_names: The dictionary to decode the interned keys with, if any
         :return: The final list that contains all the key value pairs of the trie
         """
         if node.is_terminal:
-            val = node.value
-            if type(node.value) is Trie:
-                items_ = dict()
-                self.dfs(node.value.root, "", items_)
-                val = items_
-            items_dict.update({prefix: val})
+            key = field_names.decode(prefix) if field_names is not None else prefix
+            items_dict.update({key: render_value(node.value, field_names)})
         for child in node.children:
-            self.dfs(node.children.get(child), prefix + child, items_dict)
+            self.dfs(node.children.get(child), prefix + child, items_dict, field_names)
+
+    def to_dict(self, field_names: Optional[FieldNameDictionary] = None) -> dict:
+        """Renders the Trie, and all the nested maps/tries, back to a dictionary
+        :param field_names: The dictionary to decode the interned keys with, if any
+        :return: The dictionary
+        """
+        items_ = dict()
+        self.dfs(self.root, "", items_, field_names)
+        return items_
 
-    def search_by_keys(self, keys: List) -> Union[dict, str]:
-        """Given a list of keys search iteratively from the 1st tier trie to all the nested tries.
+    def items(self, prefix: str = "") -> Iterator[Tuple[str, Any]]:
+        """Iterates over the stored key/value pairs of the Trie without rendering the values
+        :param prefix: Iterate only over the keys that start with this prefix
+        :return: An iterator of (key, stored value) tuples
+        """
+        node = self.root
+        for token in prefix:
+            node = node.children.get(token)
+            # Not found
+            if not node:
+                return
+
+        stack = [(node, prefix)]
+        while stack:
+            node, prefix = stack.pop()
+            if node.is_terminal:
+                yield prefix, node.value
+            for token, child in node.children.items():
+                stack.append((child, prefix + token))
+
+    def scan(self, prefix: str) -> dict:
+        """Returns all the top level key/value pairs whose key starts with the given prefix
+        :param prefix: The prefix of the keys, an empty one returns the whole keyspace
+        :return: The rendered key/value pairs
+        """
+        return {
+            key: render_value(value, self.field_names)
+            for key, value in self.items(prefix)
+        }
+
+    def search_by_keys(self, keys: List) -> Union[dict, str, None]:
+        """Given a list of keys search iteratively from the 1st tier trie to all the nested tries/maps.
         If the list contains 1 item returns all the nested key/value pairs. Returns None if no results were found.
         :param keys: List of keys to search sequentially
         :return: The value
         """
-        trie_index = self
-        value = ""
-        for key in keys:
-            value = trie_index.search(key)
-            if type(value) is Trie:
-                trie_index = value
+        if not keys:
+            return None
+        value = self.search(keys[0])
+        for key in keys[1:]:
+            # The path continues below a plain value, so there is nothing to find
+            if not isinstance(value, (Trie, CompactMap)):
+                return None
+            if self.field_names is not None:
+                key = self.field_names.lookup(key)
+                if key is None:
+                    return None
+            value = value.search(key)
 
-        if type(value) is Trie:
-            items_ = dict()
-            self.dfs(value.root, "", items_)
-            value = items_
+        return render_value(value, self.field_names)
 
-        return value
+    def build_value(self, value: Any) -> Any:
+        """Converts a value to its stored form. Nested dictionaries become CompactMaps if they are small enough,
+        or sub-Tries otherwise, and their keys are interned if the Trie holds a field name dictionary.
+        :param value: The value to convert
+        :return: The value to store
+        """
+        if type(value) is not dict:
+            return value
+        if self.field_names is not None:
+            # Fast path for the known names, they are the vast majority
+            ids = self.field_names.ids
+            keys = tuple(
+                [ids.get(key) or self.field_names.intern(key) for key in value]
+            )
+        else:
+            keys = tuple(value)
+        values = tuple(
+            [self.build_value(v) if type(v) is dict else v for v in value.values()]
+        )
+        if len(keys) <= self.compact_threshold:
+            return CompactMap(keys, values)
+        trie_ = Trie(compact_threshold=self.compact_threshold)
+        for key, value_ in zip(keys, values):
+            trie_.insert(key, value_)
+        return trie_
 
     def insert_dict(self, dictionary: dict) -> None:
-        """Given a dictionary inserts to the main Trie and creates nested sub-Tries if needed to save the nested
-        key/value pairs
+        """Given a dictionary inserts to the main Trie and creates nested CompactMaps/sub-Tries if needed to save
+        the nested key/value pairs
         :param dictionary: The dictionary to save
         :return: None
         """
-        trie_index = self
+        if self.copy_on_write:
+            # All the keys of the dictionary are published together
+            with self.write_lock:
+                root = self.root.copy()
+                fresh = {id(root)}
+                for key, value in dictionary.items():
+                    node = self.copy_path(root, key, fresh)
+                    node.is_terminal = True
+                    node.value = self.build_value(value)
+                self.root = root
+            return
+
         for key, value in dictionary.items():
-            # If the dict contains nested dicts create sub Trie
-            if type(value) is dict:
-                trie_ = Trie()
-                trie_.insert_dict(value)
-                value = trie_
-            trie_index.insert(key, value)
+            self.insert(key, self.build_value(value))
+
+    def bulk_insert(self, items: List[Tuple[str, Any]]) -> None:
+        """Inserts a batch of top level key/value pairs. The keys are sorted so each key walks down only from the
+        node where its common prefix with the previous key ends, instead of walking down from the root. With
+        copy_on_write the batch is published at once.
+        :param items: A list of (key, value) tuples. If a key is repeated the last value is kept.
+        :return: None
+        """
+        items = sorted(items, key=itemgetter(0))
+        with self.write_lock or nullcontext():
+            root = self.root.copy() if self.copy_on_write else self.root
+            # The nodes of the previous key, path[i] is the node after i tokens
+            path = [root]
+            previous = ""
+            # The batch creates lots of objects but no reference cycles, so the cyclic garbage collector would only
+            # rescan them over and over again
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                for key, value in items:
+                    common = common_prefix_length(key, previous)
+                    del path[common + 1 :]
+                    node = path[-1]
+                    for token in key[common:]:
+                        child = node.children.get(token)
+                        if child is None:
+                            child = TrieNode()
+                            node.children[token] = child
+                        elif self.copy_on_write:
+                            # The keys are sorted, so the nodes below the common prefix with the previous key were
+                            # not created by this batch and are published ones
+                            child = child.copy()
+                            node.children[token] = child
+                        node = child
+                        path.append(node)
+
+                    node.is_terminal = True
+                    node.value = self.build_value(value)
+                    previous = key
+            finally:
+                if gc_enabled:
+                    gc.enable()
+            self.root = root
+
+    def stats(self) -> dict:
+        """Walks the Trie and reports the number of records & the usage of the field name dictionary. The saved
+        memory is an estimate: every reference would otherwise hold its own copy of the field name string and every
+        sub-Trie one node per character of its field names. The size of the dictionary itself is subtracted.
+        :return: A dictionary with the statistics
+        """
+        records = 0
+        references = 0
+        saved_bytes = 0
+        stack = list()
+        for _, value in self.items():
+            records += 1
+            stack.append(value)
+            while stack:
+                value = stack.pop()
+                if type(value) is CompactMap:
+                    keys = value.keys
+                    stack.extend(value.values)
+                elif type(value) is Trie:
+                    items_ = list(value.items())
+                    keys = [key for key, _ in items_]
+                    stack.extend(value_ for _, value_ in items_)
+                else:
+                    continue
+                if self.field_names is not None:
+                    # The names past the cap of the dictionary are stored raw and save nothing
+                    keys = [key for key in keys if len(key) == 1]
+                    if type(value) is Trie:
+                        names = [self.field_names.decode(key) for key in keys]
+                        prefixes = {
+                            name[:i] for name in names for i in range(1, len(name) + 1)
+                        }
+                        saved_bytes += (len(prefixes) - len(keys)) * TRIE_NODE_SIZE
+                    saved_bytes += sum(
+                        sys.getsizeof(self.field_names.decode(key)) for key in keys
+                    )
+                references += len(keys)
+
+        if self.field_names is None:
+            return {
+                "records": records,
+                "field_names": 0,
+                "field_references": references,
+                "memory_saved_bytes": 0,
+            }
+        return {
+            "records": records,
+            "field_names": len(self.field_names),
+            "field_references": references,
+            "memory_saved_bytes": saved_bytes - self.field_names.memory_size(),
+        }
+
+
+def common_prefix_length(first: str, second: str) -> int:
+    """Binary searches the length of the common prefix of two strings, so the characters are compared by the
+    string comparison in C and not one by one.
+    :param first: The first string
+    :param second: The second string
+    :return: The length of the common prefix
+    """
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[:middle] == second[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def render_value(
+    value: Any, field_names: Optional[FieldNameDictionary] = None
+) -> Optional[Any]:
+    """Renders a stored value back to its plain form, i.e. nested CompactMaps & Tries become dictionaries
+    :param value: The stored value
+    :param field_names: The dictionary to decode the interned keys with, if any
+    :return: The rendered value
+    """
+    if isinstance(value, (Trie, CompactMap)):
+        return value.to_dict(field_names)
+    return value
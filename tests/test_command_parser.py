@@ -0,0 +1,133 @@
+import ast
+
+import pytest
+
+from tools.command_parser import (
+    MAX_DEPTH,
+    parse_data,
+    decode_string,
+    CustomParsingException,
+)
+from tools.general_tools import (
+    extract_routing_key,
+    parse_command,
+    CustomValidationException,
+)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        "{'a': 1, 'b': 2.5, 'c': 'x', 'd': True, 'e': None, 'f': False}",
+        "{'a': {'b': {'c': [1, -2, +3, 1e3, .5, 5.]}}}",
+        "['key1', 'key2']",
+        "{}",
+        "[]",
+        "{'a': {}, 'b': []}",
+        """{"a": "b", 'c': "it's"}""",
+        "{'a': 0, 'b': 00, 'c': -0, 'd': 0.5, 'e': 01.5}",
+    ],
+)
+def test_parse_data_matches_literal_eval(data):
+    assert parse_data(data) == ast.literal_eval(data)
+
+
+def test_parse_data_separators():
+    assert parse_data("{'a': 1; 'b': 2, 'c': 3}") == {"a": 1, "b": 2, "c": 3}
+    # Trailing separators are accepted like in the Python literals
+    assert parse_data("{'a': 1;}") == {"a": 1}
+    assert parse_data("[1, 2,]") == [1, 2]
+    # Separators inside strings are not split
+    assert parse_data("{'a': 'x;y, z'}") == {"a": "x;y, z"}
+
+
+def test_parse_data_pairs():
+    assert parse_data("'p1': {'h': 1.75; 'n': {'x': 'a;b'}}", pairs=True) == {
+        "p1": {"h": 1.75, "n": {"x": "a;b"}}
+    }
+
+
+@pytest.mark.parametrize(
+    "token, expected",
+    [
+        (r"'it\'s'", "it's"),
+        (r"'a\\b'", "a\\b"),
+        (r"'line\nbreak'", "line\nbreak"),
+        (r'"é"', "é"),
+        ("'plain'", "plain"),
+    ],
+)
+def test_decode_string_escapes(token, expected):
+    assert decode_string(token) == expected
+    assert parse_data(f"{{'k': {token}}}") == {"k": expected}
+
+
+@pytest.mark.parametrize(
+    "data, position",
+    [
+        ("{'a' 1}", 5),
+        ("{'a': }", 6),
+        ("{a: 1}", 1),
+        ("{'a': 1 'b': 2}", 8),
+        ("{'a': 1}}", 8),
+        ("{'a': 1", 7),
+        ("{'a': 'x}", 6),
+        ("{'a': @}", 6),
+    ],
+)
+def test_parse_data_error_positions(data, position):
+    with pytest.raises(CustomParsingException) as e:
+        parse_data(data)
+    assert e.value.position == position
+
+
+def test_parse_data_error_positions_of_pairs():
+    with pytest.raises(CustomParsingException) as e:
+        parse_data("'x': {'a' 1}", pairs=True)
+    assert e.value.position == 10
+
+
+def test_parse_data_rejects_scalars():
+    with pytest.raises(CustomParsingException):
+        parse_data("1")
+
+
+@pytest.mark.parametrize("number", ["01", "-01", "007", "+0123"])
+def test_parse_data_rejects_leading_zeros(number):
+    with pytest.raises(CustomParsingException, match="Malformed value"):
+        parse_data(f"{{'a': {number}}}")
+
+
+def test_parse_data_depth_limit():
+    def nested(depth: int) -> str:
+        return "{'a': " * (depth - 1) + "[1]" + "}" * (depth - 1)
+
+    assert parse_data(nested(MAX_DEPTH))
+    with pytest.raises(CustomParsingException, match="Nesting deeper") as e:
+        parse_data(nested(MAX_DEPTH + 1))
+    assert e.value.position == len("{'a': ") * MAX_DEPTH
+
+
+@pytest.mark.parametrize(
+    "command, key",
+    [
+        ("PUT {'person_1': {'age': 12}}", "person_1"),
+        ("GET ['person_1']", "person_1"),
+        (r"GET ['it\'s']", "it's"),
+        ("'person_1': {'age': 12}", "person_1"),
+        ("STATS []", None),
+        ("GET [1]", None),
+    ],
+)
+def test_extract_routing_key(command, key):
+    assert extract_routing_key(command) == key
+
+
+@pytest.mark.parametrize("seconds", ["inf", "-inf", "nan", "0", "-1", "1e300", "x"])
+def test_parse_command_rejects_invalid_time_windows(seconds):
+    with pytest.raises(CustomValidationException, match="Invalid time window"):
+        parse_command(f"PROFILE memory {seconds} out")
+
+
+def test_parse_command_accepts_time_windows():
+    assert parse_command("PROFILE cpu 2.5 out") == ("PROFILE", ["cpu", "2.5", "out"])
@@ -0,0 +1,47 @@
+import pytest
+
+from server.loader import load_file, single_pair
+from server.trie import Trie
+from tools.general_tools import shard_for_key
+
+LINES = [
+    "'a': {'x': 1}; 'b': {'x': 2}; 'c': {'x': 3}; 'd': {'x': 4}",
+    "'e': {'x': '}; f'}",
+    "'g': {'y': {'z': [1, {}]}}",
+    "'h': {'x' 1}",
+]
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("'a': {'x': 1}\n", True),
+        ("'a': {'x': [1, {}]};\n", True),
+        ("'a': {'x': '}; '}", True),
+        ("'a': {'x': 1}; 'b': {'x': 2}", False),
+        ("'a': {'x': 1}; 'b': 2", False),
+        ("'a': 1; 'b': {'x': 2}", False),
+        ("'a': 1", False),
+    ],
+)
+def test_single_pair(line, expected):
+    assert single_pair(line) == expected
+
+
+@pytest.mark.parametrize("shards", [1, 2, 3, 4])
+def test_load_file_keeps_the_keys_of_the_shard(tmp_path, shards):
+    path = tmp_path / "data.txt"
+    path.write_text("\n".join(LINES) + "\n")
+
+    owners = dict()
+    rejected = 0
+    for index in range(shards):
+        trie = Trie()
+        report = load_file(trie, str(path), (index, shards), processes=1)
+        rejected += report["rejected"]
+        for key, _ in trie.items():
+            assert shard_for_key(key, shards) == index
+            assert key not in owners
+            owners[key] = index
+    assert sorted(owners) == ["a", "b", "c", "d", "e", "g"]
+    assert rejected == 1
@@ -0,0 +1,56 @@
+import threading as td
+
+from concurrent.futures import Future
+
+from broker.replicas import ReplicaRead, Scheduler
+from tools.general_tools import merge_server_results
+
+
+class FakeConnection:
+    """A connection whose responses are resolved by the test"""
+
+    def __init__(self):
+        self.futures = list()
+
+    def request(self, payload, on_latency=None):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+def found(result):
+    return result not in ["NOT FOUND", "CONNECTION REFUSED"]
+
+
+def test_failover_and_hedge_claim_different_servers():
+    ranked = [FakeConnection(), FakeConnection()]
+    read = ReplicaRead("GET ['a']", ranked, 1, merge_server_results, found)
+    # The hedge claims the last server, so the refused read has nowhere to fail over
+    read.hedge()
+    ranked[0].futures[0].set_result("CONNECTION REFUSED")
+    assert [len(connection.futures) for connection in ranked] == [1, 1]
+    assert not read.future.done()
+    ranked[1].futures[0].set_result("{'x': 1}")
+    assert read.future.result() == "{'x': 1}"
+
+
+def test_failed_merge_resolves_the_read():
+    def merge(_):
+        raise ValueError("malformed")
+
+    connection = FakeConnection()
+    read = ReplicaRead("SCAN []", [connection], 1, merge, found)
+    connection.futures[0].set_result("{'x'")
+    assert isinstance(read.future.exception(timeout=1), ValueError)
+
+
+def test_scheduler_survives_a_failed_callback():
+    scheduler = Scheduler()
+    called = td.Event()
+
+    def fail():
+        raise IndexError()
+
+    scheduler.call_later(0, fail)
+    scheduler.call_later(0.01, called.set)
+    assert called.wait(timeout=1)
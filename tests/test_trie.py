@@ -0,0 +1,16 @@
+import pytest
+
+from server.trie import Trie
+
+
+@pytest.mark.parametrize("copy_on_write", [False, True])
+def test_delete_only_stored_keys(copy_on_write):
+    trie = Trie(copy_on_write=copy_on_write)
+    trie.insert("k1", {"a": 1})
+    root = trie.root
+    # "k" is the prefix of a key, not a key
+    assert not trie.delete("k")
+    assert trie.root is root
+    assert trie.delete("k1")
+    assert not trie.delete("k1")
+    assert trie.search("k1") is None
@@ -0,0 +1,195 @@
+import ast
+import re
+
+from typing import Union
+
+# A single regex pass splits the data to tokens: strings, numbers, punctuation & constants. Any other non-space
+# character becomes a token of its own and is reported as an error by the parser.
+TOKEN_PATTERN = re.compile(
+    r"""'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*"|[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?|[{}\[\]:;,]|True\b|False\b|None\b|\S"""
+)
+
+CONSTANTS = {"True": True, "False": False, "None": None}
+
+# Maximum nesting of the dictionaries & lists. The Trie & the rendering of the values are recursive, so deeper data
+# would exhaust the recursion limit of the server.
+MAX_DEPTH = 100
+
+# Parser states
+EXPECT_VALUE = 0
+EXPECT_KEY = 1
+EXPECT_COLON = 2
+EXPECT_SEPARATOR = 3
+EXPECT_END = 4
+
+
+class CustomParsingException(Exception):
+    def __init__(self, message: str, position: int):
+        super().__init__(f"{message} at position {position}")
+        self.position = position
+
+
+def decode_string(token: str) -> str:
+    """Decodes a quoted string token. Escape sequences are rare, so only then the token is passed to the Python
+    parser.
+    :param token: The quoted string token
+    :return: The string
+    """
+    if "\\" not in token:
+        return token[1:-1]
+    return ast.literal_eval(token)
+
+
+def decode_number(token: str) -> Union[int, float]:
+    """Decodes a number token. Like the Python literals, integers with leading zeros are rejected.
+    :param token: The number token
+    :return: The int or float number
+    """
+    if "." in token or "e" in token or "E" in token:
+        return float(token)
+    digits = token.lstrip("+-")
+    if len(digits) > 1 and digits[0] == "0" and digits.strip("0"):
+        raise ValueError(f"Leading zeros in {token}")
+    return int(token)
+
+
+def token_position(data: str, index: int) -> int:
+    """Finds the position of a token in the data. It is needed only to report errors, so the hot path of the
+    parser doesn't keep track of the positions.
+    :param data: The parsed data
+    :param index: The index of the token
+    :return: The position of the token or the length of the data if the index is past the last token
+    """
+    for index_, match in enumerate(TOKEN_PATTERN.finditer(data)):
+        if index_ == index:
+            return match.start()
+    return len(data)
+
+
+def parse_data(data: str, pairs: bool = False) -> Union[dict, list]:
+    """Single pass parser of the data of the commands. It accepts the dictionaries & lists of the Python literal
+    syntax that the commands use, with values of str, int, float, bool, None, nested dictionaries & lists, and the
+    key/value pairs separated with either ';' or ','. Keys must be strings.
+    :param data: The data string, e.g. "{'person1': {'height': 1.75; 'profession': 'student'}}" or "['key1', 'key2']"
+    :param pairs: If True the data are key/value pairs without the enclosing curly brackets, e.g.
+    "'person1': {'height': 1.75; 'profession': 'student'}"
+    :return: The parsed dictionary or list
+    """
+    tokens = TOKEN_PATTERN.findall(data)
+    offset = 0
+    if pairs:
+        tokens = ["{"] + tokens + ["}"]
+        offset = 1
+
+    result = None
+    stack = list()  # The open dictionaries & lists
+    keys = list()  # The pending key of each open dictionary
+    state = EXPECT_VALUE
+    index = 0
+    try:
+        for index, token in enumerate(tokens):
+            first = token[0]
+            if state == EXPECT_VALUE:
+                if (first == "{" or first == "[") and len(stack) == MAX_DEPTH:
+                    raise CustomParsingException(
+                        f"Nesting deeper than {MAX_DEPTH} levels",
+                        token_position(data, index - offset),
+                    )
+                if first == "{":
+                    stack.append(dict())
+                    keys.append(None)
+                    state = EXPECT_KEY
+                    continue
+                elif first == "[":
+                    stack.append(list())
+                    keys.append(None)
+                    continue
+                elif first == "]" and stack and type(stack[-1]) is list:
+                    # Empty list or trailing separator
+                    value = stack.pop()
+                    keys.pop()
+                elif first == "'" or first == '"':
+                    if len(token) < 2 or token[-1] != first:
+                        raise CustomParsingException(
+                            "Unterminated string", token_position(data, index - offset)
+                        )
+                    value = decode_string(token)
+                elif first in "0123456789-+.":
+                    value = decode_number(token)
+                elif token in CONSTANTS:
+                    value = CONSTANTS[token]
+                else:
+                    raise CustomParsingException(
+                        f"Expected a value, found {token!r}",
+                        token_position(data, index - offset),
+                    )
+            elif state == EXPECT_SEPARATOR:
+                if first == ";" or first == ",":
+                    state = EXPECT_KEY if type(stack[-1]) is dict else EXPECT_VALUE
+                    continue
+                elif (first == "}" and type(stack[-1]) is dict) or (
+                    first == "]" and type(stack[-1]) is list
+                ):
+                    value = stack.pop()
+                    keys.pop()
+                else:
+                    raise CustomParsingException(
+                        f"Expected a separator or a closing bracket, found {token!r}",
+                        token_position(data, index - offset),
+                    )
+            elif state == EXPECT_KEY:
+                if first == "'" or first == '"':
+                    if len(token) < 2 or token[-1] != first:
+                        raise CustomParsingException(
+                            "Unterminated string", token_position(data, index - offset)
+                        )
+                    keys[-1] = decode_string(token)
+                    state = EXPECT_COLON
+                    continue
+                elif first == "}":
+                    # Empty dictionary or trailing separator
+                    value = stack.pop()
+                    keys.pop()
+                else:
+                    raise CustomParsingException(
+                        f"Expected a quoted key, found {token!r}",
+                        token_position(data, index - offset),
+                    )
+            elif state == EXPECT_COLON:
+                if first != ":":
+                    raise CustomParsingException(
+                        f"Expected ':', found {token!r}",
+                        token_position(data, index - offset),
+                    )
+                state = EXPECT_VALUE
+                continue
+            else:
+                raise CustomParsingException(
+                    f"Unexpected {token!r} after the end of the data",
+                    token_position(data, index - offset),
+                )
+
+            # A value is complete, attach it to its container
+            if not stack:
+                result = value
+                state = EXPECT_END
+            elif type(stack[-1]) is dict:
+                stack[-1][keys[-1]] = value
+                state = EXPECT_SEPARATOR
+            else:
+                stack[-1].append(value)
+                state = EXPECT_SEPARATOR
+    except ValueError:
+        raise CustomParsingException(
+            f"Malformed value {tokens[index]!r}", token_position(data, index - offset)
+        )
+    except SyntaxError:
+        raise CustomParsingException(
+            f"Malformed string {tokens[index]!r}", token_position(data, index - offset)
+        )
+
+    if state != EXPECT_END:
+        raise CustomParsingException("Unexpected end of the data", len(data))
+    if type(result) not in [dict, list]:
+        raise CustomParsingException("Expected a dictionary or a list", 0)
+    return result
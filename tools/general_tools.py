@@ -1,11 +1,42 @@
 import ast
 import logging
+import math
+import os
+import re
+import threading as td
+import zlib
 
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
 from socket import inet_aton, error as socket_error
+from socketserver import StreamRequestHandler
+
+from tools.command_parser import parse_data, decode_string, CustomParsingException
 
 logger = logging.getLogger(__name__)
 
+# Matches the first top level key of a socket level command, e.g. 'person_1' at "PUT {'person_1': {...}}", or of a
+# data file line, e.g. 'person_1' at "'person_1': {...}"
+ROUTING_KEY_PATTERN = re.compile(
+    r"""^(?:\w+ [{\[])?\s*('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")"""
+)
+
+# The commands of the broker prompt & of the socket level
+COMMANDS = [
+    "GET",
+    "QUERY",
+    "DELETE",
+    "PUT",
+    "STATS",
+    "SCAN",
+    "LOAD",
+    "SNAPSHOT",
+    "PROFILE",
+    "TIMERS",
+]
+
+# Modes of the PROFILE command
+PROFILE_MODES = ["cpu", "sampling", "memory"]
+
 
 class CustomValidationException(Exception):
     pass
@@ -15,6 +46,13 @@ class CustomBrokerConnectionException(Exception):
     pass
 
 
+class PipelinedRequestHandler(StreamRequestHandler):
+    """Base of the handlers of the servers, the dispatcher & the broker, which answer pipelined commands"""
+
+    # Pipelined responses are small writes, so they must not wait for the ACK of the previous ones
+    disable_nagle_algorithm = True
+
+
 def validate_keyfile_types(keyfile_type: str) -> None:
     """Validates if a given type from a key file is string", "float" or "int"
     :param keyfile_type: The type to check
@@ -55,12 +93,46 @@ def parse_command(command: str) -> Tuple:
     """
     command_parts = command.split(" ", 1)
     command_parts[0] = command_parts[0].upper()
-    if command_parts[0] not in ["GET", "QUERY", "DELETE", "PUT"]:
+    if command_parts[0] not in COMMANDS:
         raise CustomValidationException(
-            'Available commands are: "GET", "QUERY", "DELETE", "PUT"'
+            f"Available commands are: {', '.join(COMMANDS)}"
         )
 
-    if command_parts[0] == "PUT":
+    if command_parts[0] == "STATS":
+        return command_parts[0], []
+    elif command_parts[0] == "SCAN":
+        # The prefix is optional, an empty one scans the whole keyspace
+        prefix = command_parts[1].strip() if len(command_parts) > 1 else ""
+        return command_parts[0], [prefix]
+    elif command_parts[0] in ["LOAD", "SNAPSHOT"]:
+        if len(command_parts) < 2 or not command_parts[1].strip():
+            raise CustomValidationException(
+                f"{command_parts[0]} accepts the path of a data file"
+            )
+        return command_parts[0], [command_parts[1].strip()]
+    elif command_parts[0] == "PROFILE":
+        # PROFILE <mode> <seconds> <path> or PROFILE stop
+        arguments = command_parts[1].split(maxsplit=2) if len(command_parts) > 1 else []
+        if arguments == ["stop"]:
+            return command_parts[0], arguments
+        if len(arguments) != 3 or arguments[0] not in PROFILE_MODES:
+            raise CustomValidationException(
+                f"PROFILE accepts <{'|'.join(PROFILE_MODES)}> <seconds> <path> or stop"
+            )
+        parse_time_window(arguments[1])
+        return command_parts[0], arguments
+    elif command_parts[0] == "TIMERS":
+        # TIMERS on|off|reset, or just TIMERS for the report
+        arguments = command_parts[1].split() if len(command_parts) > 1 else []
+        if arguments not in [[], ["on"], ["off"], ["reset"]]:
+            raise CustomValidationException("TIMERS accepts on, off, reset or nothing")
+        return command_parts[0], arguments
+    elif len(command_parts) < 2 or not command_parts[1].strip():
+        argument = "a k/v pair" if command_parts[0] == "PUT" else "a key"
+        raise CustomValidationException(
+            f"{command_parts[0]} accepts {argument} as parameter"
+        )
+    elif command_parts[0] == "PUT":
         return command_parts[0], data_string_to_dict(command_parts[1])
     else:
         data_list = data_string_to_list(command_parts[1])
@@ -78,22 +150,85 @@ def parse_command_for_server(command: str) -> Tuple:
     serialized input data
     """
     command_parts = command.split(" ", 1)
-    if command_parts[0] not in ["GET", "QUERY", "DELETE", "PUT"]:
+    if command_parts[0] not in COMMANDS:
         raise CustomValidationException(
-            'Available commands are: "GET", "QUERY", "DELETE", "PUT"'
+            f"Available commands are: {', '.join(COMMANDS)}"
         )
     try:
-        data = ast.literal_eval(command_parts[1])
-        if (command_parts[0] == "PUT" and type(data) is dict) or (
-            command_parts[0] in ["GET", "DELETE", "QUERY"] and type(data) is list
-        ):
+        data = parse_data(command_parts[1])
+        if (
+            (command_parts[0] == "PUT" and type(data) is dict)
+            or (command_parts[0] != "PUT" and type(data) is list)
+        ) and all(type(key) is str for key in data):
             return command_parts[0], data
         else:
             raise CustomValidationException("Malformed data received")
-    except (ValueError, SyntaxError, TypeError) as e:
+    except (CustomParsingException, IndexError) as e:
         raise CustomValidationException(e)
 
 
+def parse_time_window(seconds: str) -> float:
+    """Parses the time window of a PROFILE command. inf & nan are floats too, but a session with them would never stop.
+    :param seconds: The time window in seconds
+    :return: The time window
+    """
+    try:
+        value = float(seconds)
+    except ValueError:
+        raise CustomValidationException(f"Invalid time window {seconds}")
+    if not math.isfinite(value) or not 0 < value <= td.TIMEOUT_MAX:
+        raise CustomValidationException(
+            f"Invalid time window {seconds}, it should be a positive number of seconds"
+        )
+    return value
+
+
+def resolve_data_path(data_dir: str, path: str) -> str:
+    """Resolves a path that a client sent (LOAD, SNAPSHOT & PROFILE) under the data directory of the server, so the
+    clients can't read or write any other file of the server
+    :param data_dir: The data directory of the server
+    :param path: The path relative to the data directory
+    :return: The resolved path
+    """
+    if not path or os.path.isabs(path) or ".." in re.split(r"[\\/]", path):
+        raise CustomValidationException(
+            f"Invalid path {path}, it should be relative to the data directory without '..'"
+        )
+    root = os.path.realpath(data_dir)
+    resolved = os.path.realpath(os.path.join(root, path))
+    # Symbolic links may still point outside of the data directory
+    if os.path.commonpath([root, resolved]) != root:
+        raise CustomValidationException(
+            f"Invalid path {path}, outside of the data directory"
+        )
+    return resolved
+
+
+def shard_for_key(key: str, shards: int) -> int:
+    """Returns the shard that owns a top level key. The hash is stable across processes, unlike hash().
+    :param key: The top level key
+    :param shards: The number of shards
+    :return: The index of the shard
+    """
+    return zlib.crc32(bytes(key, "utf-8")) % shards
+
+
+def extract_routing_key(command: str) -> Optional[str]:
+    """Extracts the first top level key of a socket level command or of a data file line without parsing the whole
+    data
+    :param command: The socket level command, e.g. "PUT {'person_1': {'age': 12}}" or "GET ['person_1']", or the data
+    file line, e.g. "'person_1': {'age': 12}"
+    :return: The key or None if it cannot be extracted
+    """
+    match = ROUTING_KEY_PATTERN.match(command)
+    if not match:
+        return None
+    try:
+        return decode_string(match.group(1))
+    except (ValueError, SyntaxError):
+        return None
+
+
 def read_data_from_file(file) -> List:
     """Reads data from a data file and performs validation. Each line is transformed to a dictionary.
     :param file: The file to serialize
@@ -161,18 +296,11 @@ def data_string_to_dict(string_data: str) -> Dict:
     :param string_data: The data string
     :return: The serialized data as a single dictionary
     """
-    str_dict = "{" + string_data + "}"
-    str_dict = str_dict.replace(";", ",")
     try:
-        dictionary = ast.literal_eval(str_dict)
-    except (ValueError, SyntaxError, TypeError) as e:
-        raise CustomValidationException(
-            "Data should be complaint to the following pattern\n\t"
-            "'<key>':{'key_1': 'value_1'; 'key_2': 'value_2';}"
-        )
-    if type(dictionary) is not dict:
+        dictionary = parse_data(string_data, pairs=True)
+    except CustomParsingException as e:
         raise CustomValidationException(
-            "Data should be complaint to the following pattern\n\t"
+            f"{e}\nData should be complaint to the following pattern\n\t"
             "'<key>': {'key_1': 'value_1'; 'key_2': 'value_2';}"
         )
 
@@ -214,3 +342,37 @@ def merge_server_results(results: List[str]) -> str:
         final_result = item
 
     return final_result
+
+
+def merge_scan_results(results: List[str]) -> str:
+    """Given a list of server's responses to a SCAN command returns the union of the found key/value pairs.
+    :param results: A list of responses ["{'a': {'b': 1}}", "{'c': {'d': 2}}", 'NOT FOUND', 'ERROR']
+    :return: From the list above it will return "{'a': {'b': 1}, 'c': {'d': 2}}"
+    """
+    merged = dict()
+    for item in results:
+        if item.startswith("{"):
+            merged.update(ast.literal_eval(item))
+    if merged:
+        return str(merged)
+    return merge_server_results(results)
+
+
+def merge_stats_results(results: List[str]) -> str:
+    """Given a list of responses to a STATS or LOAD command of disjoint shards returns the aggregated statistics.
+    The counters are summed, except the size of the field name dictionaries which overlap and the durations of the
+    shards that ran in parallel.
+    :param results: A list of responses ["{'records': 2, 'field_names': 3}", "{'records': 1, 'field_names': 2}"]
+    :return: From the list above it will return "{'records': 3, 'field_names': 3}", "ERROR" if any shard failed
+    """
+    merged = dict()
+    for item in results:
+        # The statistics without a shard would look like the total
+        if not item.startswith("{"):
+            return "ERROR"
+        for key, value in ast.literal_eval(item).items():
+            if key in ["field_names", "seconds"]:
+                merged[key] = max(merged.get(key, 0), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return str(merged)